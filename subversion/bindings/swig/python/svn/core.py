@@ -26,6 +26,7 @@
 from libsvn.core import *
 import libsvn.core as _libsvncore
 import atexit as _atexit
+import io as _io
 import sys
 # __all__ is defined later, since some svn_* functions are implemented below.
 
@@ -163,37 +164,128 @@ def svn_rangelist_merge(rangelist, changes):
 def svn_rangelist_reverse(rangelist):
   return _libsvncore.svn_swig_rangelist_reverse(rangelist)
 
-class Stream:
-  """A file-object-like wrapper for Subversion svn_stream_t objects."""
-  def __init__(self, stream):
+class Stream(_io.RawIOBase):
+  """A file-object-like wrapper for Subversion svn_stream_t objects.
+
+  Reads go to the underlying stream in pieces of up to CHUNK_SIZE bytes.
+  readinto() fills a caller-provided buffer (a bytearray or a writable
+  memoryview) directly, and readline() and iteration buffer what they
+  read past the end of the line for the next read.
+
+  close() closes the svn_stream_t, but a Stream that is garbage collected
+  without being closed leaves it open, as the stream may belong to the
+  caller."""
+  def __init__(self, stream, chunk_size=SVN_STREAM_CHUNK_SIZE):
+    _io.RawIOBase.__init__(self)
     self._stream = stream
+    self.chunk_size = int(chunk_size)
+    # data read ahead by readline(), returned before reading the stream;
+    # _buffer[_pos:] is what hasn't been returned yet, and _buffer is
+    # empty once it all has
+    self._buffer = b''
+    self._pos = 0
 
-  def read(self, amt=None):
+  def __del__(self):
+    # Unlike io.IOBase, don't close the underlying stream.
+    self._stream = None
+
+  def readable(self):
+    return True
+
+  def writable(self):
+    return True
+
+  def _check_open(self):
     if self._stream is None:
-      raise ValueError
-    if amt is None:
+      raise ValueError('I/O operation on closed stream')
+
+  def _take(self, amt):
+    "Return up to AMT bytes from the read-ahead buffer."
+    pos = self._pos
+    data = self._buffer[pos:pos + amt]
+    self._pos = pos + len(data)
+    if self._pos == len(self._buffer):
+      self._buffer = b''
+      self._pos = 0
+    return data
+
+  def readinto(self, b):
+    self._check_open()
+    n = len(b)
+    if n == 0:
+      return 0
+    if self._buffer:
+      data = self._take(n)
+    else:
+      data = svn_stream_read(self._stream, n)
+    n = len(data)
+    b[:n] = data
+    return n
+
+  def readall(self):
+    self._check_open()
+    chunks = [ self._take(len(self._buffer) - self._pos) ]
+    while True:
+      data = svn_stream_read(self._stream, self.chunk_size)
+      if not data:
+        break
+      chunks.append(data)
+    return b''.join(chunks)
+
+  def read(self, amt=None):
+    self._check_open()
+    if amt is None or amt < 0:
       # read the rest of the stream
-      chunks = [ ]
-      while True:
-        data = svn_stream_read(self._stream, SVN_STREAM_CHUNK_SIZE)
-        if not data:
-          break
-        chunks.append(data)
-      return ''.join(chunks)
+      return self.readall()
 
     # read the amount specified
-    return svn_stream_read(self._stream, int(amt))
+    amt = int(amt)
+    if self._buffer:
+      data = self._take(amt)
+      if len(data) == amt:
+        return data
+      return data + svn_stream_read(self._stream, amt - len(data))
+    return svn_stream_read(self._stream, amt)
+
+  def readline(self, size=-1):
+    self._check_open()
+    if size is None:
+      size = -1
+    chunks = [ ]
+    length = 0
+    while size < 0 or length < size:
+      if not self._buffer:
+        self._buffer = svn_stream_read(self._stream, self.chunk_size)
+        if not self._buffer:
+          break
+      end = self._buffer.find(b'\n', self._pos) + 1
+      if end == 0:
+        end = len(self._buffer)
+      amt = end - self._pos
+      if size >= 0:
+        amt = min(amt, size - length)
+      chunks.append(self._take(amt))
+      length = length + amt
+      if chunks[-1].endswith(b'\n'):
+        break
+    return b''.join(chunks)
 
   def write(self, buf):
-    if self._stream is None:
-      raise ValueError
+    self._check_open()
+    if isinstance(buf, (bytearray, memoryview)):
+      buf = memoryview(buf).tobytes()
     ### what to do with the amount written? (the result value)
     svn_stream_write(self._stream, buf)
+    return len(buf)
 
   def close(self):
     if self._stream is not None:
-      svn_stream_close(self._stream)
+      stream = self._stream
       self._stream = None
+      self._buffer = b''
+      self._pos = 0
+      svn_stream_close(stream)
+    _io.RawIOBase.close(self)
 
 def secs_from_timestr(svn_datetime, pool=None):
   """Convert a Subversion datetime string into seconds since the Epoch."""
@@ -41,7 +41,9 @@ CHANGE_ACTION_DELETE  = 2
 CHANGE_ACTION_REPLACE = 3
 
 
-class ChangedPath:
+class ChangedPath(object):
+  # A collector keeps one of these for each path changed in a revision,
+  # so they must stay small: new-style, for __slots__ to take effect.
   __slots__ = [ 'item_kind', 'prop_changes', 'text_changed',
                 'base_path', 'base_rev', 'path', 'added', 'action',
                 ]
@@ -75,7 +77,8 @@ class ChangedPath:
 class ChangeCollector(_svndelta.Editor):
   """An editor that, when driven, walks a revision or a transaction and
   incrementally invokes a callback with ChangedPath instances corresponding to
-  paths changed in that revision.
+  paths changed in that revision.  Once it has been driven, iterating over
+  it yields the changes in path order.
 
   Available Since: 1.2.0
   """
@@ -119,6 +122,12 @@ class ChangeCollector(_svndelta.Editor):
   def get_changes(self):
     return self.changes
 
+  def __iter__(self):
+    "Yield the ChangedPath objects collected so far, in path order."
+    changes = self.changes
+    for path in sorted(changes):
+      yield changes[path]
+
   def _send_change(self, path):
     if self.notify_cb:
       change = self.changes.get(path)
@@ -268,6 +277,155 @@ class ChangeCollector(_svndelta.Editor):
     self._send_change(file_baton[0])
 
 
+class PathsChangedCollector:
+  """A faster alternative to ChangeCollector, which reads the changes
+  recorded for a revision or a transaction with svn_fs_paths_changed2()
+  rather than replaying them through a delta editor, so that there is no
+  call into Python for each directory and file on the way.
+
+  Iterating over the collector yields a ChangedPath for each changed
+  path, in path order, computing each one only when it is asked for.
+  get_changes() and get_root_props() work as in ChangeCollector.
+
+  The ChangedPath objects are the same as ChangeCollector's, except that
+  a replaced path gives a single object, with action
+  CHANGE_ACTION_REPLACE.
+  """
+
+  def __init__(self, fs_ptr, root, pool=None, notify_cb=None):
+    """Construct a collector over the svn_fs_root_t ROOT, which must
+    be in the svn_fs_t FS_PTR.  Invoke NOTIFY_CB with a single argument
+    of type ChangedPath for each change yielded.
+
+    ### POOL is unused
+    """
+
+    self.fs_ptr = fs_ptr
+    self.changes = None # path -> ChangedPath, once get_changes() is called
+    self.roots = { } # revision -> svn_svnfs_root_t
+    self.notify_cb = notify_cb
+    self.fs_root = root
+
+    # Figger out the base revision and root properties.
+    if _svnfs.is_revision_root(self.fs_root):
+      rev = _svnfs.revision_root_revision(self.fs_root)
+      self.base_rev = rev - 1
+      self.props = _svnfs.revision_proplist(self.fs_ptr, rev)
+    else:
+      txn_name = _svnfs.txn_root_name(self.fs_root)
+      txn_t = _svnfs.open_txn(self.fs_ptr, txn_name)
+      self.base_rev = _svnfs.txn_base_revision(txn_t)
+      self.props = _svnfs.txn_proplist(txn_t)
+
+  def get_root_props(self):
+    return self.props
+
+  def get_changes(self):
+    if self.changes is None:
+      changes = { }
+      for change in self:
+        changes[change.path] = change
+      self.changes = changes
+    return self.changes
+
+  def _get_root(self, rev):
+    try:
+      return self.roots[rev]
+    except KeyError:
+      pass
+    root = self.roots[rev] = _svnfs.revision_root(self.fs_ptr, rev)
+    return root
+
+  def _copyfrom(self, fs_path, change):
+    "Return the (base_path, base_rev) CHANGE, an add, was copied from."
+    if change.copyfrom_known:
+      return change.copyfrom_path, change.copyfrom_rev
+    rev, path = _svnfs.copied_from(self.fs_root, fs_path)
+    if rev == _svncore.SVN_INVALID_REVNUM:
+      return None, rev
+    return path, rev
+
+  def _base(self, path, copies):
+    """Return the (base_path, base_rev) of PATH, which was changed or
+    deleted: the path it had in the base revision, unless one of its
+    parents was copied here."""
+    if copies:
+      parent = path
+      while parent:
+        parent = parent[:max(parent.rfind('/'), 0)]
+        try:
+          copyfrom_path, copyfrom_rev = copies[parent]
+        except KeyError:
+          continue
+        if copyfrom_path and copyfrom_rev != _svncore.SVN_INVALID_REVNUM:
+          return copyfrom_path + path[len(parent):], copyfrom_rev
+        break
+    return path, self.base_rev
+
+  def __iter__(self):
+    changed = _svnfs.paths_changed2(self.fs_root)
+
+    # The paths added here (without the leading '/'), with their
+    # copy sources; the bases of paths below them derive from these.
+    copies = { }
+    for fs_path, change in changed.items():
+      if change.change_kind in (_svnfs.path_change_add,
+                                _svnfs.path_change_replace):
+        copies[fs_path[1:]] = self._copyfrom(fs_path, change)
+
+    for fs_path in sorted(changed):
+      change = changed[fs_path]
+      path = fs_path[1:]
+      kind = change.change_kind
+      item_kind = change.node_kind
+
+      if kind == _svnfs.path_change_delete:
+        base_path, base_rev = self._base(path, copies)
+        if item_kind == _svncore.svn_node_unknown:
+          if _svnfs.is_dir(self._get_root(base_rev), base_path):
+            item_kind = _svncore.svn_node_dir
+          else:
+            item_kind = _svncore.svn_node_file
+        changed_path = ChangedPath(item_kind,
+                                   False,
+                                   False,
+                                   base_path,
+                                   base_rev,
+                                   path,
+                                   False,
+                                   CHANGE_ACTION_DELETE,
+                                   )
+      elif kind == _svnfs.path_change_reset:
+        continue
+      else:
+        if item_kind == _svncore.svn_node_unknown:
+          item_kind = _svnfs.check_path(self.fs_root, fs_path)
+        if kind == _svnfs.path_change_modify:
+          base_path, base_rev = self._base(path, copies)
+          added = False
+          action = CHANGE_ACTION_MODIFY
+        else:
+          base_path, base_rev = copies[path]
+          added = True
+          if kind == _svnfs.path_change_replace:
+            action = CHANGE_ACTION_REPLACE
+          else:
+            action = CHANGE_ACTION_ADD
+        changed_path = ChangedPath(item_kind,
+                                   bool(change.prop_mod),
+                                   bool(change.text_mod),
+                                   base_path,
+                                   base_rev,
+                                   path,
+                                   added,
+                                   action,
+                                   )
+
+      if self.notify_cb:
+        self.notify_cb(changed_path)
+      yield changed_path
+
+
 class RevisionChangeCollector(ChangeCollector):
   """Deprecated: Use ChangeCollector.
   This is a compatibility wrapper providing the interface of the
@@ -280,6 +280,54 @@ class SubversionRepositoryTestCase(unittest.TestCase):
       repos.dir_delta(prev_root, '', '', this_root, '', e_ptr, e_baton,
               _authz_callback, 1, 1, 0, 0)
 
+  def _commit_prop_and_text_changes(self):
+    """Commit a change to the props only of trunk/README.txt and to the
+    text only of trunk/README2.txt, and return the new revision"""
+    txn = repos.fs_begin_txn_for_commit(self.repos, self.rev, "jrandom",
+                                        "Props here, text there")
+    root = fs.txn_root(txn)
+    fs.change_node_prop(root, "trunk/README.txt", "color", "blue")
+    stream = fs.apply_text(root, "trunk/README2.txt", None)
+    core.svn_stream_write(stream, "A new README2\n")
+    core.svn_stream_close(stream)
+    repos.fs_commit_txn(self.repos, txn)
+    return fs.youngest_rev(self.fs)
+
+  def test_paths_changed_collector(self):
+    """Test PathsChangedCollector against ChangeCollector"""
+    youngest = self._commit_prop_and_text_changes()
+    for rev in range(1, youngest + 1):
+      root = fs.revision_root(self.fs, rev)
+      editor = repos.ChangeCollector(self.fs, root)
+      e_ptr, e_baton = delta.make_editor(editor)
+      repos.replay2(root, '', core.SVN_INVALID_REVNUM, 1, e_ptr, e_baton,
+                    _authz_callback)
+      expected = editor.get_changes()
+      self.assertEqual([change.path for change in editor], sorted(expected))
+
+      collector = repos.PathsChangedCollector(self.fs, root)
+      self.assertEqual(collector.get_root_props(), editor.get_root_props())
+      changes = list(collector)
+      self.assertEqual([change.path for change in changes], sorted(expected))
+      for change in changes:
+        other = expected[change.path]
+        self.assertEqual((change.item_kind, change.prop_changes,
+                          change.text_changed, change.base_path,
+                          change.base_rev, change.added, change.action),
+                         (other.item_kind, other.prop_changes,
+                          other.text_changed, other.base_path,
+                          other.base_rev, other.added, other.action))
+
+    root = fs.revision_root(self.fs, youngest)
+    changes = repos.PathsChangedCollector(self.fs, root).get_changes()
+    self.assertEqual(sorted(changes), ["trunk/README.txt", "trunk/README2.txt"])
+    self.assertEqual((changes["trunk/README.txt"].prop_changes,
+                      changes["trunk/README.txt"].text_changed),
+                     (True, False))
+    self.assertEqual((changes["trunk/README2.txt"].prop_changes,
+                      changes["trunk/README2.txt"].text_changed),
+                     (False, True))
+
   def test_retrieve_and_change_rev_prop(self):
     """Test playing with revprops"""
     self.assertEqual(repos.fs_revision_prop(self.repos, self.rev, "svn:log",
@@ -301,6 +349,35 @@ class SubversionRepositoryTestCase(unittest.TestCase):
                                             _authz_callback),
                      "Youngest revision")
 
+  def test_stream(self):
+    """Test reading file contents through core.Stream"""
+    root = fs.revision_root(self.fs, self.rev)
+
+    stream = core.Stream(fs.file_contents(root, 'trunk/README.txt'))
+    self.assertEqual(stream.read(), b'A test.\n')
+    stream.close()
+    self.assertTrue(stream.closed)
+    self.assertRaises(ValueError, stream.read)
+
+    # Fill a caller-provided buffer, a few bytes at a time.
+    stream = core.Stream(fs.file_contents(root, 'trunk/README.txt'))
+    buf = bytearray(3)
+    chunks = []
+    while True:
+      n = stream.readinto(buf)
+      if not n:
+        break
+      chunks.append(bytes(buf[:n]))
+    stream.close()
+    self.assertEqual(b''.join(chunks), b'A test.\n')
+
+    # Lines come out whole, whatever the chunk size.
+    stream = core.Stream(fs.file_contents(root, 'trunk/README.txt'),
+                         chunk_size=2)
+    self.assertEqual(stream.readline(3), b'A t')
+    self.assertEqual(list(stream), [b'est.\n'])
+    stream.close()
+
   def freeze_body(self, pool):
     self.freeze_invoked += 1
 
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+#
+# changed-paths-memory.py: measure the memory the change records of a
+#                          huge commit take in mailer.py
+#
+# USAGE: changed-paths-memory.py [PATHS | REPOS-PATH REVISION]
+#
+# The changeset is either made up, as a branch creation adding PATHS
+# files (default 1000000), or loaded from REVISION of the repository at
+# REPOS-PATH with svn.repos.PathsChangedCollector. It is then held, in a
+# fresh process for each layout, as:
+#
+#   dict        records with a per-instance __dict__ (as ChangedPath had
+#               under Python 2 before it was a new-style class), in the
+#               sorted list of (path, change) pairs mailer.py used to keep
+#   slots       ChangedPath records, in that same list of pairs
+#   changelist  ChangedPath records in a mailer.ChangeList
+#
+# and the memory taken is reported, as traced by tracemalloc where it is
+# available and as the growth of the resident set size otherwise.
+#
+
+import os
+import sys
+import subprocess
+
+import svn.core
+import svn.fs
+import svn.repos
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', 'hook-scripts', 'mailer'))
+import mailer
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+LAYOUTS = [ 'dict', 'slots', 'changelist' ]
+
+
+class DictChangedPath:
+  def __init__(self, item_kind, prop_changes, text_changed, base_path,
+               base_rev, path, added, action):
+    self.item_kind = item_kind
+    self.prop_changes = prop_changes
+    self.text_changed = text_changed
+    self.base_path = base_path
+    self.base_rev = base_rev
+    self.path = path
+    self.added = added
+    self.action = action
+
+
+def made_up_changes(count, record):
+  changes = { }
+  for i in range(count):
+    path = 'd%04d/f%03d.txt' % (i // 1000, i % 1000)
+    changes['branches/b1/' + path] = record(svn.core.svn_node_file,
+                                            False, False,
+                                            '/trunk/' + path, 100,
+                                            'branches/b1/' + path,
+                                            True,
+                                            svn.repos.CHANGE_ACTION_ADD)
+  return changes
+
+
+def loaded_changes(repos_dir, rev, record, pool):
+  fs_ptr = svn.repos.fs(svn.repos.open(repos_dir, pool))
+  root = svn.fs.revision_root(fs_ptr, rev, pool)
+  changes = { }
+  for change in svn.repos.PathsChangedCollector(fs_ptr, root, pool):
+    if record is not svn.repos.ChangedPath:
+      change = record(change.item_kind, change.prop_changes,
+                      change.text_changed, change.base_path, change.base_rev,
+                      change.path, change.added, change.action)
+    changes[change.path] = change
+  return changes
+
+
+def rss():
+  for line in open('/proc/self/status'):
+    if line.startswith('VmRSS:'):
+      return int(line.split()[1]) * 1024
+  return 0
+
+
+def measure(pool, layout, args):
+  if layout == 'dict':
+    record = DictChangedPath
+  else:
+    record = svn.repos.ChangedPath
+
+  if tracemalloc:
+    tracemalloc.start()
+  else:
+    start = rss()
+
+  if len(args) == 2:
+    changes = loaded_changes(args[0], int(args[1]), record, pool)
+  else:
+    changes = made_up_changes(int(args[0]), record)
+
+  # As Commit.__init__ does, before and after the change to ChangeList.
+  if layout == 'changelist':
+    changelist = mailer.ChangeList(changes.values())
+  else:
+    changelist = sorted(changes.items())
+  changes = None
+
+  if tracemalloc:
+    size = tracemalloc.get_traced_memory()[0]
+  else:
+    size = rss() - start
+  print('%-10s %8d paths  %8.1f MB  %6d bytes/path'
+        % (layout, len(changelist), size / 1048576.0,
+           size // max(len(changelist), 1)))
+
+
+if __name__ == '__main__':
+  if len(sys.argv) > 2 and sys.argv[1] == '--layout':
+    svn.core.run_app(measure, sys.argv[2], sys.argv[3:])
+  else:
+    args = sys.argv[1:] or [ '1000000' ]
+    for layout in LAYOUTS:
+      sys.stdout.flush()
+      subprocess.call([sys.executable, os.path.abspath(__file__),
+                       '--layout', layout] + args)
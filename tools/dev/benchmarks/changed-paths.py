@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+#
+# changed-paths.py: time collecting the changes of large revisions with
+#                   svn.repos.ChangeCollector, driven by svn_repos_replay2,
+#                   and with svn.repos.PathsChangedCollector
+#
+# USAGE: changed-paths.py [FILES]
+#
+# A scratch repository is created with FILES files (default 100000), in
+# directories of 1000, added in r1; every file is modified in r2 and
+# trunk is copied to a branch, with one directory deleted, in r3. The
+# changes of each revision are then collected both ways.
+#
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+import svn.core
+import svn.fs
+import svn.delta
+import svn.repos
+
+FILES_PER_DIR = 1000
+
+
+def file_path(i):
+  return 'trunk/d%03d/f%05d.txt' % (i // FILES_PER_DIR, i)
+
+
+def commit(repos, rev, files, pool):
+  txn = svn.repos.fs_begin_txn_for_commit(repos, rev - 1, 'bench',
+                                          'r%d' % rev, pool)
+  root = svn.fs.txn_root(txn, pool)
+  subpool = svn.core.svn_pool_create(pool)
+  if rev == 3:
+    svn.fs.copy(svn.fs.revision_root(svn.repos.fs(repos), 2, subpool),
+                'trunk', root, 'branches/b1', subpool)
+    svn.fs.delete(root, 'branches/b1/d000', subpool)
+  else:
+    if rev == 1:
+      svn.fs.make_dir(root, 'trunk', subpool)
+      svn.fs.make_dir(root, 'branches', subpool)
+    for i in range(files):
+      path = file_path(i)
+      if rev == 1:
+        if i % FILES_PER_DIR == 0:
+          svn.fs.make_dir(root, os.path.dirname(path), subpool)
+        svn.fs.make_file(root, path, subpool)
+      stream = svn.fs.apply_text(root, path, None, subpool)
+      svn.core.svn_stream_write(stream, '%s in r%d\n' % (path, rev))
+      svn.core.svn_stream_close(stream)
+      svn.core.svn_pool_clear(subpool)
+  svn.core.svn_pool_destroy(subpool)
+  svn.repos.fs_commit_txn(repos, txn, pool)
+
+
+def replay(fs_ptr, root, pool):
+  editor = svn.repos.ChangeCollector(fs_ptr, root, pool)
+  e_ptr, e_baton = svn.delta.make_editor(editor, pool)
+  svn.repos.replay2(root, '', svn.core.SVN_INVALID_REVNUM, 1,
+                    e_ptr, e_baton, None, pool)
+  return editor.get_changes()
+
+
+def paths_changed(fs_ptr, root, pool):
+  return svn.repos.PathsChangedCollector(fs_ptr, root, pool).get_changes()
+
+
+def main(pool, files):
+  scratch = tempfile.mkdtemp()
+  try:
+    repos_dir = os.path.join(scratch, 'repos')
+    repos = svn.repos.create(repos_dir, None, None, None, None, pool)
+    for rev in (1, 2, 3):
+      commit(repos, rev, files, pool)
+
+    fs_ptr = svn.repos.fs(repos)
+    for rev in (1, 2, 3):
+      root = svn.fs.revision_root(fs_ptr, rev, pool)
+      results = [ ]
+      for name, collect in (('replay', replay),
+                            ('paths_changed2', paths_changed)):
+        subpool = svn.core.svn_pool_create(pool)
+        start = time.time()
+        changes = collect(fs_ptr, root, subpool)
+        elapsed = time.time() - start
+        results.append(sorted(changes))
+        print('r%d %-15s %7d paths  %8.2f s  %6.2f us/path'
+              % (rev, name, len(changes), elapsed,
+                 elapsed * 1000000.0 / max(len(changes), 1)))
+        changes = None
+        svn.core.svn_pool_destroy(subpool)
+      if results[0] != results[1]:
+        print('r%d: the collectors found different paths' % rev)
+  finally:
+    shutil.rmtree(scratch)
+
+
+if __name__ == '__main__':
+  files = 100000
+  if len(sys.argv) > 1:
+    files = int(sys.argv[1])
+  svn.core.run_app(main, files)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+#
+# diff-bench.py: time mailer.py on one large commit, with diffs made by
+#                the external diff command and with in-memory diffs
+#
+# USAGE: diff-bench.py [FILES] [LINES]
+#
+# A scratch repository is created with FILES files (default 5000) of
+# LINES lines each (default 50) in r1, and every file is modified in r2.
+# The message for r2 is then generated with in_memory_diff_limit unset
+# and set, and discarded.
+#
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+import svn.core
+import svn.fs
+import svn.repos
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import mailer
+
+
+CONFIG = '''[general]
+
+[defaults]
+diff = /usr/bin/diff -u -L %%(label_from)s -L %%(label_to)s %%(from)s %%(to)s
+in_memory_diff_limit = %d
+from_addr = bench@example.com
+to_addr = bench@example.com
+generate_diffs = add copy modify
+'''
+
+
+class NullWriter:
+  def __init__(self):
+    self.bytes = 0
+
+  def write(self, data):
+    self.bytes = self.bytes + len(data)
+
+  def flush(self):
+    pass
+
+
+def file_text(i, lines, rev):
+  text = [ ]
+  for j in range(lines):
+    if rev > 1 and j % 10 == i % 10:
+      text.append('line %d of file %d, changed in r%d\n' % (j, i, rev))
+    else:
+      text.append('line %d of file %d\n' % (j, i))
+  return ''.join(text)
+
+
+def commit(repos, files, lines, rev, pool):
+  fs_ptr = svn.repos.fs(repos)
+  txn = svn.repos.fs_begin_txn_for_commit(repos, rev - 1, 'bench',
+                                          'r%d' % rev, pool)
+  root = svn.fs.txn_root(txn, pool)
+  subpool = svn.core.svn_pool_create(pool)
+  for i in range(files):
+    path = 'trunk/f%05d.txt' % i
+    if rev == 1:
+      if i == 0:
+        svn.fs.make_dir(root, 'trunk', subpool)
+      svn.fs.make_file(root, path, subpool)
+    stream = svn.fs.apply_text(root, path, None, subpool)
+    svn.core.svn_stream_write(stream, file_text(i, lines, rev))
+    svn.core.svn_stream_close(stream)
+    svn.core.svn_pool_clear(subpool)
+  svn.core.svn_pool_destroy(subpool)
+  svn.repos.fs_commit_txn(repos, txn, pool)
+
+
+def run(repos_dir, config_fname, pool):
+  sink = NullWriter()
+  stdout = sys.stdout
+  sys.stdout = sink
+  try:
+    start = time.time()
+    mailer.main(pool, 'commit', config_fname, repos_dir, ['2'])
+    elapsed = time.time() - start
+  finally:
+    sys.stdout = stdout
+  return elapsed, sink.bytes
+
+
+def main(pool, files, lines):
+  scratch = tempfile.mkdtemp()
+  try:
+    repos_dir = os.path.join(scratch, 'repos')
+    repos = svn.repos.create(repos_dir, None, None, None, None, pool)
+    commit(repos, files, lines, 1, pool)
+    commit(repos, files, lines, 2, pool)
+
+    for name, limit in (('diff command', 0), ('in memory', 1024 * 1024)):
+      config_fname = os.path.join(scratch, 'mailer-%d.conf' % limit)
+      open(config_fname, 'w').write(CONFIG % limit)
+      elapsed, size = run(repos_dir, config_fname, pool)
+      print('%-12s %5d files  %8.2f s  %6.2f ms/file  %9d bytes'
+            % (name, files, elapsed, elapsed * 1000.0 / files, size))
+  finally:
+    shutil.rmtree(scratch)
+
+
+if __name__ == '__main__':
+  files = 5000
+  lines = 50
+  if len(sys.argv) > 1:
+    files = int(sys.argv[1])
+  if len(sys.argv) > 2:
+    lines = int(sys.argv[2])
+  svn.core.run_app(main, files, lines)
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+#
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+#
+# mailer-daemon.py: run mailer.py jobs in a long-lived process
+#
+# USAGE: mailer-daemon.py [OPTIONS] SPOOL-DIR
+#
+#   Jobs are queued in SPOOL-DIR by mailer-enqueue.py, which the hooks
+#   run instead of mailer.py, or by the daemon itself for the commits
+#   announced by SvnPubSub (--pubsub, with a --repos option for each
+#   repository to mail about). A job is removed once its mail has been
+#   sent, so jobs survive a restart of the daemon; a job that fails is
+#   moved to SPOOL-DIR/failed. The standard input saved with a job (see
+#   mailer_spool.py) is given to mailer.py as its standard input.
+#
+#   Unlike a hook running mailer.py, the daemon loads Python and the
+#   Subversion bindings once, keeps each repository open and reuses the
+#   parsed configuration (see ConfigCache in mailer.py) across jobs.
+#
+#   The daemon runs in the foreground; use a process supervisor to keep
+#   it running. svnpubsub/client.py must be on PYTHONPATH for --pubsub.
+#
+
+import os
+import sys
+import time
+import errno
+import select
+import socket
+import logging
+import optparse
+import threading
+
+import svn.core
+import svn.fs
+import svn.repos
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import mailer
+import mailer_spool
+
+# Failed jobs are moved here, inside the spool directory.
+FAILED_NAME = 'failed'
+
+# Look for jobs at least this often (seconds), in case a wake-up got lost.
+RESCAN_INTERVAL = 60.0
+
+
+class MailerDaemon:
+  def __init__(self, pool, spool_dir, config_fname=None):
+    self.pool = pool
+    self.spool_dir = spool_dir
+    self.config_fname = config_fname
+
+    # repos_dir -> open repository, allocated in the daemon's pool
+    self.handles = { }
+
+    self.failed_dir = os.path.join(spool_dir, FAILED_NAME)
+    if not os.path.isdir(self.failed_dir):
+      os.mkdir(self.failed_dir)
+
+  def open_repos(self, repos_dir):
+    try:
+      return self.handles[repos_dir]
+    except KeyError:
+      repos_ptr = self.handles[repos_dir] = svn.repos.open(repos_dir,
+                                                          self.pool)
+      return repos_ptr
+
+  def listen(self):
+    path = os.path.join(self.spool_dir, mailer_spool.SOCKET_NAME)
+    try:
+      os.remove(path)
+    except OSError:
+      pass
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(path)
+    sock.setblocking(0)
+    return sock
+
+  def run(self):
+    sock = self.listen()
+    logging.info('serving %s', self.spool_dir)
+    while True:
+      self.process_spool()
+      try:
+        readable = select.select([sock], [], [], RESCAN_INTERVAL)[0]
+      except select.error as e:
+        if e.args[0] != errno.EINTR:
+          raise
+        continue
+      if readable:
+        # one scan handles any number of wake-ups
+        while True:
+          try:
+            sock.recv(64)
+          except socket.error:
+            break
+
+  def process_spool(self):
+    "Run the jobs in the spool, oldest first."
+    for name in mailer_spool.jobs(self.spool_dir):
+      files = mailer_spool.job_files(self.spool_dir, name)
+      args = None
+      try:
+        args, stdin = mailer_spool.read_job(self.spool_dir, name)
+        self.run_job(args, stdin)
+      except Exception:
+        logging.exception('job %s failed: %r', name, args)
+        for fname in files:
+          os.rename(os.path.join(self.spool_dir, fname),
+                    os.path.join(self.failed_dir, fname))
+      else:
+        for fname in files:
+          os.remove(os.path.join(self.spool_dir, fname))
+
+  def run_job(self, args, stdin=None):
+    """Run mailer.py with ARGS, giving it STDIN (or nothing) to read
+    from sys.stdin."""
+    cmd = args[0]
+    repos_dir = args[1]
+    expected_args = mailer.cmd_list[cmd]
+    cmd_args = args[2:2+expected_args]
+    if len(cmd_args) != expected_args or len(args) > expected_args + 3:
+      raise ValueError('wrong number of arguments for %s' % cmd)
+    if len(args) == expected_args + 3:
+      config_fname = args[expected_args + 2]
+    else:
+      config_fname = self.config_fname or mailer.find_config(repos_dir)
+    if not os.path.exists(config_fname):
+      raise mailer.MissingConfig(config_fname)
+
+    start = time.time()
+    subpool = svn.core.svn_pool_create(self.pool)
+    # never let a job read the daemon's own stdin
+    saved_stdin = sys.stdin
+    sys.stdin = mailer.StringIO(stdin or '')
+    try:
+      mailer.main(subpool, cmd, config_fname, repos_dir, cmd_args,
+                  self.open_repos(repos_dir))
+    finally:
+      sys.stdin = saved_stdin
+      svn.core.svn_pool_destroy(subpool)
+    logging.info('%s %s %s: %.2fs', cmd, repos_dir, ' '.join(cmd_args),
+                 time.time() - start)
+
+
+class PubSubFeed(threading.Thread):
+  "Queue a commit job for each commit SvnPubSub announces in REPOSITORIES."
+
+  def __init__(self, spool_dir, urls, repositories):
+    threading.Thread.__init__(self)
+    self.setDaemon(True)
+    self.spool_dir = spool_dir
+    self.urls = urls
+
+    # repository UUID -> repos_dir
+    self.repositories = repositories
+
+  def run(self):
+    import svnpubsub.client
+    svnpubsub.client.MultiClient(self.urls, self.commit,
+                                 self._event).run_forever()
+
+  def commit(self, url, commit):
+    if getattr(commit, 'type', 'svn') != 'svn':
+      return
+    repos_dir = self.repositories.get(getattr(commit, 'repository', None))
+    if repos_dir is None:
+      return
+    logging.debug('r%s in %s from %s', commit.id, repos_dir, url)
+    mailer_spool.enqueue(self.spool_dir,
+                         ['commit', repos_dir, str(commit.id)])
+    mailer_spool.wake(self.spool_dir)
+
+  def _event(self, url, event_name, event_arg):
+    if event_name == 'error':
+      logging.error('from %s: %s', url, event_arg)
+    elif event_name == 'ping':
+      logging.debug('ping from %s', url)
+    else:
+      logging.info('"%s" from %s', event_name, url)
+
+
+def main(pool, options, spool_dir):
+  daemon = MailerDaemon(pool, spool_dir, options.config)
+
+  if options.pubsub:
+    repositories = { }
+    for repos_dir in options.repos:
+      repos_dir = os.path.abspath(repos_dir)
+      fs_ptr = svn.repos.fs(daemon.open_repos(repos_dir))
+      repositories[svn.fs.get_uuid(fs_ptr, pool)] = repos_dir
+    PubSubFeed(spool_dir, options.pubsub, repositories).start()
+
+  daemon.run()
+
+
+if __name__ == '__main__':
+  parser = optparse.OptionParser(usage='%prog [OPTIONS] SPOOL-DIR')
+  parser.add_option('--config',
+                    help='config file for jobs that name none '
+                         '(default: as for mailer.py)')
+  parser.add_option('--pubsub', action='append', default=[],
+                    help='SvnPubSub URL to queue commits from; may repeat')
+  parser.add_option('--repos', action='append', default=[],
+                    help='repository to mail about for --pubsub; may repeat')
+  parser.add_option('--logfile',
+                    help='log here rather than to stderr')
+  parser.add_option('--debug', action='store_true', default=False,
+                    help='log debug messages')
+  options, args = parser.parse_args()
+  if len(args) != 1:
+    parser.error('SPOOL-DIR is required')
+  if options.pubsub and not options.repos:
+    parser.error('--pubsub needs at least one --repos')
+
+  logging.basicConfig(filename=options.logfile,
+                      level=options.debug and logging.DEBUG or logging.INFO,
+                      format='%(asctime)s [%(levelname)s] %(message)s')
+
+  svn.core.run_app(main, options, os.path.abspath(args[0]))
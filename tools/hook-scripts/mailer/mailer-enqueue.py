@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+#
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+#
+# mailer-enqueue.py: hand a mailer.py job to mailer-daemon.py
+#
+# USAGE: mailer-enqueue.py SPOOL-DIR MAILER-ARGS...
+#
+#   MAILER-ARGS are the arguments mailer.py would be run with (give any
+#   CONFIG-FILE as an absolute path), e.g.
+#
+#     mailer-enqueue.py /var/spool/mailer commit "$REPOS" "$REV"
+#
+#   The job is written to SPOOL-DIR, where it stays until the daemon
+#   has sent its mail, and the daemon is woken up through the socket in
+#   SPOOL-DIR. If the daemon is not running, the job waits for it.
+#
+#   For propchange2, lock and unlock, the hook's standard input (the old
+#   property value, or the locked paths) is saved with the job, and the
+#   daemon gives it to mailer.py as its standard input.
+#
+#   The spool directory is written as described in mailer_spool.py.
+#   This script doesn't load the Subversion bindings, so it is cheap
+#   enough to run from the hooks.
+#
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import mailer_spool
+
+
+if __name__ == '__main__':
+  if len(sys.argv) < 4:
+    sys.stderr.write("USAGE: %s SPOOL-DIR MAILER-ARGS...\n"
+                     % os.path.basename(sys.argv[0]))
+    sys.exit(1)
+
+  spool_dir = sys.argv[1]
+  args = sys.argv[2:]
+  # the daemon doesn't run in the hook's directory
+  args[1] = os.path.abspath(args[1])
+  stdin = None
+  if args[0] in mailer_spool.STDIN_COMMANDS:
+    stdin = getattr(sys.stdin, 'buffer', sys.stdin).read()
+  mailer_spool.enqueue(spool_dir, args, stdin)
+  mailer_spool.wake(spool_dir)
@@ -43,6 +43,10 @@
 #
 #   See _MIN_SVN_VERSION below for which version of Subversion's Python
 #   bindings are required by this version of mailer.py.
+#
+#   The parsed CONFIG-FILE is cached, per repository, in a hidden file
+#   next to it, or in the directory named by $MAILER_CACHE_DIR. The
+#   cache is rebuilt whenever CONFIG-FILE changes.
 
 import os
 import sys
@@ -56,13 +60,21 @@ except ImportError:
   from urllib import quote as urllib_parse_quote
 import time
 import subprocess
+import threading
+import collections
+import operator
+import hashlib
+import marshal
 if sys.version_info[0] >= 3:
   # Python >=3.0
   from io import StringIO
+  import queue
 else:
   # Python <3.0
   from cStringIO import StringIO
+  import Queue as queue
 import smtplib
+import socket
 import re
 import tempfile
 
@@ -74,6 +86,7 @@ _MIN_SVN_VERSION = [1, 5, 0]
 try:
   import svn.fs
   import svn.delta
+  import svn.diff
   import svn.repos
   import svn.core
 except ImportError:
@@ -89,15 +102,25 @@ if _MIN_SVN_VERSION > [svn.core.SVN_VER_MAJOR,
     % ".".join([str(x) for x in _MIN_SVN_VERSION]))
   sys.exit(1)
 
+# svn_diff_mem_string_output_unified3() is new in 1.9; without it, every
+# diff goes through temporary files.
+_have_mem_diff = hasattr(svn.diff, 'mem_string_output_unified3')
+
+# The arguments of a diff command whose output the in-memory diff gives.
+_PLAIN_DIFF_ARGS = ['-u', '-L', '%(label_from)s', '-L', '%(label_to)s',
+                    '%(from)s', '%(to)s']
+
 
 SEPARATOR = '=' * 78
 
-def main(pool, cmd, config_fname, repos_dir, cmd_args):
+def main(pool, cmd, config_fname, repos_dir, cmd_args, repos_ptr=None):
+  """Run the mailer subcommand CMD. REPOS_PTR, if given, is the already
+  open repository at REPOS_DIR."""
   ### TODO:  Sanity check the incoming args
 
   if cmd == 'commit':
     revision = int(cmd_args[0])
-    repos = Repository(repos_dir, revision, pool)
+    repos = Repository(repos_dir, revision, pool, repos_ptr)
     cfg = Config(config_fname, repos,
                  {'author': repos.author,
                   'repos_basename': os.path.basename(repos.repos_dir)
@@ -108,7 +131,7 @@ def main(pool, cmd, config_fname, repos_dir, cmd_args):
     author = cmd_args[1]
     propname = cmd_args[2]
     action = (cmd == 'propchange2' and cmd_args[3] or 'A')
-    repos = Repository(repos_dir, revision, pool)
+    repos = Repository(repos_dir, revision, pool, repos_ptr)
     # Override the repos revision author with the author of the propchange
     repos.author = author
     cfg = Config(config_fname, repos,
@@ -118,7 +141,7 @@ def main(pool, cmd, config_fname, repos_dir, cmd_args):
     messenger = PropChange(pool, cfg, repos, author, propname, action)
   elif cmd == 'lock' or cmd == 'unlock':
     author = cmd_args[0]
-    repos = Repository(repos_dir, 0, pool) ### any old revision will do
+    repos = Repository(repos_dir, 0, pool, repos_ptr) ### any old revision will do
     # Override the repos revision author with the author of the lock/unlock
     repos.author = author
     cfg = Config(config_fname, repos,
@@ -131,6 +154,29 @@ def main(pool, cmd, config_fname, repos_dir, cmd_args):
 
   messenger.generate()
 
+  if getattr(cfg.general, 'debug', 'no') == 'yes':
+    sys.stderr.write('mailer.py: r%d: %s\n' % (repos.rev, repos.cache_stats()))
+
+
+# Command list:  subcommand -> number of arguments expected (not including
+#                              the repository directory and config-file)
+cmd_list = {'commit'     : 1,
+            'propchange' : 3,
+            'propchange2': 4,
+            'lock'       : 1,
+            'unlock'     : 1,
+            }
+
+
+def find_config(repos_dir):
+  "Return the default config file for REPOS_DIR."
+  # Default to REPOS-DIR/conf/mailer.conf.
+  config_fname = os.path.join(repos_dir, 'conf', 'mailer.conf')
+  if not os.path.exists(config_fname):
+    # Okay.  Look for 'mailer.conf' as a sibling of this script.
+    config_fname = os.path.join(os.path.dirname(sys.argv[0]), 'mailer.conf')
+  return config_fname
+
 
 def remove_leading_slashes(path):
   while path and path[0] == '/':
@@ -291,12 +337,148 @@ class SMTPOutput(MailedOutput):
     self.write(self.mail_headers(group, params))
 
   def finish(self):
-    server = smtplib.SMTP(self.cfg.general.smtp_hostname)
-    if self.cfg.is_set('general.smtp_username'):
-      server.login(self.cfg.general.smtp_username,
-                   self.cfg.general.smtp_password)
-    server.sendmail(self.from_addr, self.to_addrs, self.buffer.getvalue())
-    server.quit()
+    smtp_session(self.cfg).send(self.from_addr, self.to_addrs,
+                                   self.buffer.getvalue())
+
+
+class SMTPSession:
+  """A connection to the SMTP server, opened when first needed and then
+  used for every message sent to that server for the life of the process.
+
+  Sending is retried after errors that may go away (a dropped connection,
+  a timeout or a 4xx reply), reconnecting each time. If the message still
+  can't be sent and [general].smtp_spool_dir is set, it is saved there and
+  sent after the next message that gets through."""
+
+  # How many times to retry a message, and how long to wait (seconds)
+  # before all but the first retry.
+  RETRIES = 3
+  RETRY_DELAY = 5
+
+  def __init__(self, hostname, username=None, password=None, timeout=None,
+               spool_dir=None):
+    self.hostname = hostname
+    self.username = username
+    self.password = password
+    self.timeout = timeout and float(timeout) or None
+    self.spool_dir = spool_dir
+    self.server = None
+
+  def _connect(self):
+    if self.server is not None:
+      return
+    if self.timeout:
+      server = smtplib.SMTP(self.hostname, timeout=self.timeout)
+    else:
+      server = smtplib.SMTP(self.hostname)
+    if self.username:
+      server.login(self.username, self.password)
+    self.server = server
+
+  def close(self):
+    "Say goodbye to the server, if connected."
+    if self.server is not None:
+      try:
+        self.server.quit()
+      except (smtplib.SMTPException, socket.error):
+        pass
+      self.server = None
+
+  def _drop(self):
+    if self.server is not None:
+      try:
+        self.server.close()
+      except socket.error:
+        pass
+      self.server = None
+
+  def send(self, from_addr, to_addrs, message):
+    for attempt in range(self.RETRIES + 1):
+      if attempt > 1:
+        time.sleep(self.RETRY_DELAY)
+      try:
+        self._connect()
+        self.server.sendmail(from_addr, to_addrs, message)
+        break
+      except Exception as e:
+        if not _smtp_error_is_transient(e):
+          self._drop()
+          raise
+        self._drop()
+        if attempt == self.RETRIES:
+          if not self.spool_dir:
+            raise
+          self._spool(from_addr, to_addrs, message)
+          return
+    self._send_spooled()
+
+  def _spool(self, from_addr, to_addrs, message):
+    name = '%020.6f-%d' % (time.time(), os.getpid())
+    tmp = os.path.join(self.spool_dir, name + '.tmp')
+    f = open(tmp, 'w')
+    f.write('%s\n%s\n' % (from_addr, ' '.join(to_addrs)))
+    f.write(message)
+    f.close()
+    os.rename(tmp, os.path.join(self.spool_dir, name + '.msg'))
+    sys.stderr.write('mailer.py: SMTP delivery to %s failed; message saved '
+                     'in %s\n' % (self.hostname, self.spool_dir))
+
+  def _send_spooled(self):
+    "Send the messages left by earlier failures, while the server is up."
+    if not self.spool_dir:
+      return
+    for name in sorted(os.listdir(self.spool_dir)):
+      if not name.endswith('.msg'):
+        continue
+      path = os.path.join(self.spool_dir, name)
+      f = open(path)
+      from_addr = f.readline()[:-1]
+      to_addrs = f.readline()[:-1].split()
+      message = f.read()
+      f.close()
+      try:
+        self._connect()
+        self.server.sendmail(from_addr, to_addrs, message)
+      except Exception as e:
+        self._drop()
+        if _smtp_error_is_transient(e):
+          # try again after the next message
+          return
+        # don't let it hold up the rest
+        os.rename(path, path[:-4] + '.bad')
+        sys.stderr.write('mailer.py: could not send %s: %s\n' % (path, e))
+        continue
+      os.remove(path)
+
+
+# (hostname, username, password, timeout, spool_dir) -> SMTPSession
+_smtp_sessions = { }
+
+def smtp_session(cfg):
+  "Return the SMTPSession for the SMTP settings in CFG."
+  general = cfg.general
+  settings = (general.smtp_hostname,
+              getattr(general, 'smtp_username', None),
+              getattr(general, 'smtp_password', None),
+              getattr(general, 'smtp_timeout', None),
+              getattr(general, 'smtp_spool_dir', None))
+  try:
+    return _smtp_sessions[settings]
+  except KeyError:
+    session = _smtp_sessions[settings] = SMTPSession(*settings)
+    return session
+
+def close_smtp_sessions():
+  for session in _smtp_sessions.values():
+    session.close()
+
+def _smtp_error_is_transient(e):
+  if isinstance(e, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError,
+                    socket.error)):
+    return True
+  if isinstance(e, smtplib.SMTPResponseException):
+    return 400 <= e.smtp_code < 500
+  return False
 
 
 class StandardOutput(OutputBase):
@@ -372,7 +554,7 @@ class Commit(Messenger):
     e_ptr, e_baton = svn.delta.make_editor(editor, self.pool)
     svn.repos.replay2(repos.root_this, "", svn.core.SVN_INVALID_REVNUM, 1, e_ptr, e_baton, None, self.pool)
 
-    self.changelist = sorted(editor.get_changes().items())
+    self.changelist = ChangeList(editor.get_changes().values())
 
     log = repos.get_rev_prop(svn.core.SVN_PROP_REVISION_LOG) or ''
 
@@ -381,14 +563,14 @@ class Commit(Messenger):
     for path, change in self.changelist:
       for (group, params) in self.cfg.which_groups(path, log):
         # turn the params into a hashable object and stash it away
-        param_list = sorted(params.items())
+        key = (group, tuple(sorted(params.items())))
         # collect the set of paths belonging to this group
-        if (group, tuple(param_list)) in self.groups:
-          old_param, paths = self.groups[group, tuple(param_list)]
+        if key in self.groups:
+          paths = self.groups[key][1]
         else:
           paths = { }
+          self.groups[key] = (params, paths)
         paths[path] = None
-        self.groups[group, tuple(param_list)] = (params, paths)
 
     # figure out the changed directories
     dirs = { }
@@ -419,25 +601,82 @@ class Commit(Messenger):
 
     ### the groups need to be further compressed. if the headers and
     ### body are the same across groups, then we can have multiple To:
-    ### addresses. SMTPOutput holds the entire message body in memory,
-    ### so if the body doesn't change, then it can be sent N times
-    ### rather than rebuilding it each time.
+    ### addresses.
 
     subpool = svn.core.svn_pool_create(self.pool)
 
     # build a renderer, tied to our output stream
     renderer = TextCommitRenderer(self.output)
 
+    # Groups whose content keys are equal get identical bodies. Such a
+    # body is rendered once, kept in memory and then written for each of
+    # its groups; bodies needed only once are streamed as before.
+    keys = { }
+    uses = { }
+    for (group, param_tuple), (params, paths) in self.groups.items():
+      key = content_key(self.cfg, self.repos, group, params, paths)
+      keys[group, param_tuple] = key
+      uses[key] = uses.get(key, 0) + 1
+
+    # Different bodies still share some of their diffs. Keep those of the
+    # files that more than one body shows, each until the last such body
+    # has used it: path -> [bodies left, { diff key: result }].
+    # Directories have no diffs.
+    files = dict([(path, None) for path, change in self.changelist
+                  if change.item_kind != svn.core.svn_node_dir])
+    shown = { }
+    for (group, param_tuple), (params, paths) in self.groups.items():
+      key = keys[group, param_tuple]
+      if key in shown:
+        continue
+      if (self.cfg.get('show_nonmatching_paths', group, params)
+          or 'yes') == 'yes':
+        shown[key] = files
+      else:
+        shown[key] = paths
+    counts = { }
+    for paths in shown.values():
+      for path in paths:
+        if path in files:
+          counts[path] = counts.get(path, 0) + 1
+    diff_cache = dict([(path, [count, { }])
+                       for path, count in counts.items() if count > 1])
+    if not diff_cache:
+      diff_cache = None
+
+    # Run external diff commands in the background, if asked to.
+    workers = int(getattr(self.cfg.general, 'diff_workers', '') or 1)
+    if workers > 1:
+      diff_pool = DiffPool(workers,
+                           int(getattr(self.cfg.general, 'diff_buffer_limit',
+                                       '') or DiffPool.BUFFER_LIMIT))
+    else:
+      diff_pool = None
+
+    bodies = { }
     for (group, param_tuple), (params, paths) in self.groups.items():
       self.output.start(group, params)
 
-      # generate the content for this group and set of params
-      generate_content(renderer, self.cfg, self.repos, self.changelist,
-                       group, params, paths, subpool)
+      key = keys[group, param_tuple]
+      if key in bodies:
+        self.output.write(bodies[key])
+      elif uses[key] > 1:
+        buffer = StringIO()
+        generate_content(TextCommitRenderer(buffer), self.cfg, self.repos,
+                         self.changelist, group, params, paths, subpool,
+                         diff_cache, diff_pool)
+        bodies[key] = buffer.getvalue()
+        self.output.write(bodies[key])
+      else:
+        # generate the content for this group and set of params
+        generate_content(renderer, self.cfg, self.repos, self.changelist,
+                         group, params, paths, subpool, diff_cache, diff_pool)
 
       self.output.finish()
       svn.core.svn_pool_clear(subpool)
 
+    if diff_pool:
+      diff_pool.close()
     svn.core.svn_pool_destroy(subpool)
 
 
@@ -652,8 +891,33 @@ class DiffURLSelections:
   def get_modify_url(self, repos_rev, change):
     return self._get_url('modify', repos_rev, change)
 
+def content_key(cfg, repos, group, params, paths):
+  """Return a hashable key that captures everything generate_content()
+  looks up for GROUP and PARAMS, so that equal keys mean equal content."""
+  params_with_rev = params.copy()
+  params_with_rev['rev'] = repos.rev
+  key = [frozenset(paths),
+         cfg.get('show_nonmatching_paths', group, params),
+         cfg.get('commit_url', group, params_with_rev),
+         cfg.get('diff', group, None),
+         cfg.get('in_memory_diff_limit', group, None),
+         ]
+  for option in ('max_diff_size', 'max_diff_lines', 'max_message_size'):
+    key.append(cfg.get(option, group, params))
+  for option in ('generate_diffs', 'suppress_deletes', 'suppress_adds'):
+    key.append(cfg.get(option, group, params))
+  # The diff URLs are formatted per path, so compare the templates and,
+  # if there are any, the params they may draw on.
+  templates = tuple([cfg.get('diff_%s_url' % action, group, None)
+                     for action in ('add', 'copy', 'delete', 'modify')])
+  key.append(templates)
+  if [_f for _f in templates if _f]:
+    key.append(tuple(sorted(params.items())))
+  return tuple(key)
+
+
 def generate_content(renderer, cfg, repos, changelist, group, params, paths,
-                     pool):
+                     pool, diff_cache=None, diff_pool=None):
 
   svndate = repos.get_rev_prop(svn.core.SVN_PROP_REVISION_DATE)
   ### pick a different date format?
@@ -669,6 +933,8 @@ def generate_content(renderer, cfg, repos, changelist, group, params, paths,
   params_with_rev['rev'] = repos.rev
   commit_url = cfg.get('commit_url', group, params_with_rev)
 
+  budget = DiffBudget(cfg, group, params)
+
   # figure out the lists of changes outside the selected path-space
   other_added_data = other_replaced_data = other_deleted_data = \
       other_modified_data = [ ]
@@ -680,7 +946,8 @@ def generate_content(renderer, cfg, repos, changelist, group, params, paths,
 
   if len(paths) != len(changelist) and show_nonmatching_paths == 'yes':
     other_diffs = DiffGenerator(changelist, paths, False, cfg, repos, date,
-                                group, params, diffsels, diffurls, pool)
+                                group, params, diffsels, diffurls, budget,
+                                pool, diff_cache, diff_pool)
   else:
     other_diffs = None
 
@@ -700,46 +967,103 @@ def generate_content(renderer, cfg, repos, changelist, group, params, paths,
     other_deleted_data=other_deleted_data,
     other_modified_data=other_modified_data,
     diffs=DiffGenerator(changelist, paths, True, cfg, repos, date, group,
-                        params, diffsels, diffurls, pool),
+                        params, diffsels, diffurls, budget, pool,
+                        diff_cache, diff_pool),
     other_diffs=other_diffs,
+    budget=budget,
     )
   renderer.render(data)
 
 
 def generate_list(changekind, changelist, paths, in_paths):
   if changekind == 'A':
-    selection = lambda change: change.action == svn.repos.CHANGE_ACTION_ADD
+    action = svn.repos.CHANGE_ACTION_ADD
   elif changekind == 'R':
-    selection = lambda change: change.action == svn.repos.CHANGE_ACTION_REPLACE
+    action = svn.repos.CHANGE_ACTION_REPLACE
   elif changekind == 'D':
-    selection = lambda change: change.action == svn.repos.CHANGE_ACTION_DELETE
+    action = svn.repos.CHANGE_ACTION_DELETE
   elif changekind == 'M':
-    selection = lambda change: change.action == svn.repos.CHANGE_ACTION_MODIFY
-
-  items = [ ]
-  for path, change in changelist:
-    if selection(change) and (path in paths) == in_paths:
-      item = _data(
-        path=path,
-        is_dir=change.item_kind == svn.core.svn_node_dir,
-        props_changed=change.prop_changes,
-        text_changed=change.text_changed,
-        copied=(change.action == svn.repos.CHANGE_ACTION_ADD \
-                or change.action == svn.repos.CHANGE_ACTION_REPLACE) \
-               and change.base_path,
-        base_path=remove_leading_slashes(change.base_path),
-        base_rev=change.base_rev,
-        )
-      items.append(item)
+    action = svn.repos.CHANGE_ACTION_MODIFY
 
-  return items
+  return ListItems(action, changelist, paths, in_paths)
+
+
+class ChangeList:
+  """The changes of a commit, sorted by path. This is a sequence of
+  (path, change) pairs, which are made as they are asked for; only the
+  ChangedPath objects are kept."""
+
+  def __init__(self, changes):
+    self.changes = sorted(changes, key=operator.attrgetter('path'))
+
+  def __len__(self):
+    return len(self.changes)
+
+  def __getitem__(self, idx):
+    change = self.changes[idx]
+    return change.path, change
+
+  def __iter__(self):
+    for change in self.changes:
+      yield change.path, change
+
+
+class ListItems:
+  """This is a generator-like object returning a ListItem for each change
+  in CHANGELIST with the given ACTION, whose path is (or, if IN_PATHS is
+  false, isn't) in PATHS. The items are made while they are rendered, so
+  that the lists of a huge commit take no memory."""
+
+  def __init__(self, action, changelist, paths, in_paths):
+    self.action = action
+    self.changelist = changelist
+    self.paths = paths
+    self.in_paths = in_paths
+    self.empty = None
+
+  def __iter__(self):
+    action = self.action
+    paths = self.paths
+    in_paths = self.in_paths
+    for path, change in self.changelist:
+      if change.action == action and (path in paths) == in_paths:
+        yield ListItem(path, change)
+
+  def __nonzero__(self):
+    if self.empty is None:
+      self.empty = True
+      for item in self:
+        self.empty = False
+        break
+    return not self.empty
+  __bool__ = __nonzero__
+
+
+class ListItem(object):
+  "A line of the list of changes, for the change of PATH in CHANGE."
+
+  __slots__ = [ 'path', 'is_dir', 'props_changed', 'text_changed', 'copied',
+                'base_path', 'base_rev',
+                ]
+
+  def __init__(self, path, change):
+    self.path = path
+    self.is_dir = change.item_kind == svn.core.svn_node_dir
+    self.props_changed = change.prop_changes
+    self.text_changed = change.text_changed
+    self.copied = (change.action == svn.repos.CHANGE_ACTION_ADD \
+                   or change.action == svn.repos.CHANGE_ACTION_REPLACE) \
+                  and change.base_path
+    self.base_path = remove_leading_slashes(change.base_path)
+    self.base_rev = change.base_rev
 
 
 class DiffGenerator:
   "This is a generator-like object returning DiffContent objects."
 
   def __init__(self, changelist, paths, in_paths, cfg, repos, date, group,
-               params, diffsels, diffurls, pool):
+               params, diffsels, diffurls, budget, pool, diff_cache=None,
+               diff_pool=None):
     self.changelist = changelist
     self.paths = paths
     self.in_paths = in_paths
@@ -750,8 +1074,31 @@ class DiffGenerator:
     self.params = params
     self.diffsels = diffsels
     self.diffurls = diffurls
+    self.budget = budget
     self.pool = pool
 
+    # If not None, a dictionary shared by the DiffGenerators of one commit,
+    # mapping each path shown by more than one of them to the number of
+    # those yet to show it and to its (materialized) diff results, keyed
+    # by source, labels and command, so such a file is diffed only once.
+    self.diff_cache = diff_cache
+
+    # Files up to this many bytes are diffed in-process, unless that would
+    # not give what the configured diff command does.
+    if cfg.is_plain_diff(group):
+      self.memory_limit = int(cfg.get('in_memory_diff_limit', group, None)
+                              or 0)
+    else:
+      self.memory_limit = 0
+
+    # If not None, the DiffPool running external diff commands. Diffs are
+    # then started ahead of the one being rendered, and handed out in
+    # order once finished.
+    self.diff_pool = diff_pool
+    self.ahead = collections.deque()
+    self.ahead_bytes = 0
+    self.exhausted = False
+
     self.diff = self.diff_url = None
 
     self.idx = 0
@@ -761,6 +1108,32 @@ class DiffGenerator:
     return True
 
   def __getitem__(self, idx):
+    if self.diff_pool is None:
+      item = self._next_diff()
+    else:
+      # Keep the pool busy with the following diffs, within the memory
+      # their output may take while waiting to be rendered.
+      while not self.exhausted \
+            and (not self.ahead
+                 or (len(self.ahead) < 2 * self.diff_pool.workers
+                     and self.ahead_bytes < self.diff_pool.buffer_limit)):
+        try:
+          item = self._next_diff()
+        except IndexError:
+          self.exhausted = True
+          break
+        self.ahead.append(item)
+        self.ahead_bytes = self.ahead_bytes + _job_size(item.content)
+      if not self.ahead:
+        raise IndexError
+      item = self.ahead.popleft()
+      self.ahead_bytes = self.ahead_bytes - _job_size(item.content)
+
+    if isinstance(item.content, DiffJob):
+      item.content = item.content.result()
+    return item
+
+  def _next_diff(self):
     while True:
       if self.idx == len(self.changelist):
         raise IndexError
@@ -777,6 +1150,7 @@ class DiffGenerator:
       binary = None
       singular = None
       content = None
+      skipped = None
 
       # just skip directories. they have no diffs.
       if change.item_kind == svn.core.svn_node_dir:
@@ -786,6 +1160,11 @@ class DiffGenerator:
       if (path in self.paths) != self.in_paths:
         continue
 
+      # Count this body off for the path's cached diffs now, whether or not
+      # it goes on to show a diff, so that they are released once the last
+      # body sharing them is past the path.
+      cached = self._take_cached(path)
+
       if change.base_rev != -1:
         svndate = self.repos.get_rev_prop(svn.core.SVN_PROP_REVISION_DATE,
                                           change.base_rev)
@@ -887,22 +1266,25 @@ class DiffGenerator:
                    % (change.path, self.date, self.repos.rev)
           singular = False
 
-      if diff:
-        binary = diff.either_binary()
-        if binary:
-          content = src_fname = dst_fname = None
+      if diff and self.budget.message_full():
+        # don't bother reading a file we won't show
+        skipped = 'Message size limit (%d bytes) reached' \
+                  % self.budget.max_message_size
+      elif diff:
+        cache_key = (kind, change.path, base_path, change.base_rev,
+                     label1, label2, self.cfg.get('diff', self.group, None),
+                     self.memory_limit, self.budget.max_diff_size)
+        if cached is not None and cache_key in cached[1]:
+          binary, src_fname, dst_fname, content, skipped = \
+            cached[1][cache_key]
         else:
-          src_fname, dst_fname = diff.get_files()
-          try:
-            content = DiffContent(self.cfg.get_diff_cmd(self.group, {
-              'label_from' : label1,
-              'label_to' : label2,
-              'from' : src_fname,
-              'to' : dst_fname,
-              }))
-          except OSError:
-            # diff command does not exist, try difflib.unified_diff()
-            content = DifflibDiffContent(label1, label2, src_fname, dst_fname)
+          binary, src_fname, dst_fname, content, skipped = \
+            self._generate_diff(diff, label1, label2)
+          if cached is not None and cached[0] > 0:
+            if content is not None and not isinstance(content, DiffJob):
+              content = list(content)
+            cached[1][cache_key] = (binary, src_fname, dst_fname,
+                                    content, skipped)
 
       # return a data item for this diff
       return _data(
@@ -919,8 +1301,149 @@ class DiffGenerator:
         binary=binary,
         singular=singular,
         content=content,
+        skipped=skipped,
         )
 
+  def _take_cached(self, path):
+    """Return the diff cache entry of PATH, counted off for this body, or
+    None. The entry is dropped from the cache once no body is left."""
+    if self.diff_cache is None:
+      return None
+    cached = self.diff_cache.get(path)
+    if cached is not None:
+      cached[0] = cached[0] - 1
+      if cached[0] == 0:
+        del self.diff_cache[path]
+    return cached
+
+  def _generate_diff(self, diff, label1, label2):
+    binary = diff.either_binary()
+    if binary:
+      return binary, None, None, None, None
+
+    # Check the sizes before reading anything.
+    use_memory = self.memory_limit > 0 and _have_mem_diff
+    if use_memory or self.budget.max_diff_size:
+      largest = 0
+      for root, path in ((diff.root1, diff.path1), (diff.root2, diff.path2)):
+        if path is not None:
+          largest = max(largest, svn.fs.file_length(root, path, self.pool))
+      if self.budget.max_diff_size and largest > self.budget.max_diff_size:
+        return binary, None, None, None, \
+               'File too large (%d bytes)' % largest
+      if use_memory and largest <= self.memory_limit:
+        content = MemoryDiffContent(label1, label2, diff, self.pool)
+        return binary, None, None, content, None
+
+    src_fname, dst_fname = diff.get_files()
+    cmd = self.cfg.get_diff_cmd(self.group, {
+      'label_from' : label1,
+      'label_to' : label2,
+      'from' : src_fname,
+      'to' : dst_fname,
+      })
+    if self.diff_pool is not None:
+      content = DiffJob(cmd, label1, label2, src_fname, dst_fname)
+      self.diff_pool.submit(content)
+      return binary, src_fname, dst_fname, content, None
+
+    try:
+      content = DiffContent(cmd)
+    except OSError:
+      # diff command does not exist, try difflib.unified_diff()
+      content = DifflibDiffContent(label1, label2, src_fname, dst_fname)
+    return binary, src_fname, dst_fname, content, None
+
+class DiffBudget:
+  """The size limits on the diffs in one message, and the number of bytes
+  of the message written so far. A limit of 0 means no limit."""
+
+  def __init__(self, cfg, group, params):
+    self.max_diff_size = int(cfg.get('max_diff_size', group, params) or 0)
+    self.max_diff_lines = int(cfg.get('max_diff_lines', group, params) or 0)
+    self.max_message_size = int(cfg.get('max_message_size', group, params)
+                                or 0)
+    self.used = 0
+
+  def message_full(self):
+    return self.max_message_size and self.used >= self.max_message_size
+
+def _job_size(content):
+  if isinstance(content, DiffJob):
+    return content.size
+  return 0
+
+class DiffJob:
+  "An external diff, run by a DiffPool thread and read into memory."
+
+  def __init__(self, cmd, label_from, label_to, from_file, to_file):
+    self.cmd = cmd
+    self.label_from = label_from
+    self.label_to = label_to
+    self.from_file = from_file
+    self.to_file = to_file
+
+    # The diff can't be much larger than both inputs together.
+    self.size = os.path.getsize(from_file) + os.path.getsize(to_file)
+
+    self.done = threading.Event()
+    self.lines = None
+    self.exc_info = None
+
+  def run(self):
+    try:
+      try:
+        content = DiffContent(self.cmd)
+      except OSError:
+        # diff command does not exist, try difflib.unified_diff()
+        content = DifflibDiffContent(self.label_from, self.label_to,
+                                     self.from_file, self.to_file)
+      self.lines = list(content)
+    except:
+      self.exc_info = sys.exc_info()
+    self.done.set()
+
+  def result(self):
+    "Wait for the diff, and return its lines."
+    self.done.wait()
+    if self.exc_info:
+      raise self.exc_info[1]
+    return self.lines
+
+class DiffPool:
+  "A fixed set of threads running DiffJobs."
+
+  # The default for how many bytes of diff input may be queued up or
+  # waiting to be rendered at any time.
+  BUFFER_LIMIT = 64 * 1024 * 1024
+
+  def __init__(self, workers, buffer_limit=BUFFER_LIMIT):
+    self.workers = workers
+    self.buffer_limit = buffer_limit
+    self.jobs = queue.Queue()
+    self.threads = [ ]
+    for i in range(workers):
+      thread = threading.Thread(target=self._work)
+      thread.setDaemon(True)
+      thread.start()
+      self.threads.append(thread)
+
+  def _work(self):
+    while True:
+      job = self.jobs.get()
+      if job is None:
+        return
+      job.run()
+
+  def submit(self, job):
+    self.jobs.put(job)
+
+  def close(self):
+    for thread in self.threads:
+      self.jobs.put(None)
+    for thread in self.threads:
+      thread.join()
+
 def _classify_diff_line(line, seen_change):
   # classify the type of line.
   first = line[:1]
@@ -982,6 +1505,13 @@ class DiffContent:
       type=ltype,
       )
 
+  def close(self):
+    "Stop reading the diff before its end."
+    if self.pipe is not None:
+      self.pipe.stdout.close()
+      self.pipe.wait()
+      self.pipe = None
+
 class DifflibDiffContent():
   "This is a generator-like object returning annotated lines of a diff."
 
@@ -1011,16 +1541,85 @@ class DifflibDiffContent():
       type=ltype,
       )
 
+class MemoryDiffContent:
+  """This is a generator-like object returning annotated lines of a diff,
+  computed by libsvn_diff from the file contents held in memory."""
+
+  def __init__(self, label_from, label_to, filediff, pool):
+    self.seen_change = False
+    original = _read_contents(filediff.root1, filediff.path1, pool)
+    modified = _read_contents(filediff.root2, filediff.path2, pool)
+
+    options = svn.diff.file_options_create(pool)
+    diff = svn.diff.mem_string_diff(original, modified, options, pool)
+    output = _StringSink()
+    svn.diff.mem_string_output_unified3(output, diff, True, None,
+                                        label_from, label_to, 'UTF-8',
+                                        original, modified, -1, None, pool)
+
+    # every line, including the last, is terminated by a newline
+    self.lines = output.getvalue().split('\n')[:-1]
+
+  def __nonzero__(self):
+    # we always have some items
+    return True
+
+  def __getitem__(self, idx):
+    line = self.lines[idx] + '\n'
+    line, ltype, self.seen_change = _classify_diff_line(line, self.seen_change)
+    return _data(
+      raw=line,
+      text=line[1:-1],  # remove indicator and newline
+      type=ltype,
+      )
+
+def _read_contents(root, path, pool):
+  "Return the contents of PATH in ROOT as a string; '' if PATH is None."
+  if path is None:
+    return ''
+  chunks = [ ]
+  stream = svn.fs.file_contents(root, path, pool)
+  try:
+    while True:
+      chunk = svn.core.svn_stream_read(stream, svn.core.SVN_STREAM_CHUNK_SIZE)
+      if not chunk:
+        break
+      chunks.append(chunk)
+  finally:
+    svn.core.svn_stream_close(stream)
+  return ''.join(chunks)
+
+class _StringSink:
+  "A write-only file-like object for svn_stream_t output."
+  def __init__(self):
+    self.chunks = [ ]
+
+  def write(self, data):
+    self.chunks.append(data)
+
+  def close(self):
+    pass
+
+  def getvalue(self):
+    return ''.join(self.chunks)
+
 class TextCommitRenderer:
   "This class will render the commit mail in plain text."
 
   def __init__(self, output):
     self.output = output
+    self.budget = None
+
+  def _write(self, text):
+    if self.budget:
+      self.budget.used = self.budget.used + len(text)
+    self.output.write(text)
 
   def render(self, data):
     "Render the commit defined by 'data'."
 
-    w = self.output.write
+    self.budget = data.budget
+    w = self._write
 
     w('Author: %s\nDate: %s\nNew Revision: %s\n' % (data.author,
                                                       data.date,
@@ -1060,7 +1659,7 @@ class TextCommitRenderer:
     if not data_list:
       return
 
-    w = self.output.write
+    w = self._write
     w(header + ':\n')
     for d in data_list:
       if d.is_dir:
@@ -1090,7 +1689,7 @@ class TextCommitRenderer:
     any diffs to render."""
     if not diffs:
       return
-    w = self.output.write
+    w = self._write
     section_header_printed = False
 
     for diff in diffs:
@@ -1128,40 +1727,118 @@ class TextCommitRenderer:
           w('Binary file (source and/or target). No diff available.\n')
         continue
 
-      for line in diff.content:
-        w(line.raw)
+      if diff.skipped:
+        w('%s. No diff available.\n' % diff.skipped)
+        continue
+
+      self._render_content(diff)
+
+  def _render_content(self, diff):
+    "Write the lines of DIFF, stopping early at any of the budget's limits."
+    budget = self.budget
+    lines = size = 0
+    for line in diff.content:
+      lines = lines + 1
+      size = size + len(line.raw)
+      if budget.max_diff_lines and lines > budget.max_diff_lines:
+        truncated = '%d lines' % budget.max_diff_lines
+      elif budget.max_diff_size and size > budget.max_diff_size:
+        truncated = '%d bytes' % budget.max_diff_size
+      elif budget.message_full():
+        truncated = 'message size limit of %d bytes' \
+                    % budget.max_message_size
+      else:
+        self._write(line.raw)
+        continue
+
+      close = getattr(diff.content, 'close', None)
+      if close:
+        close()
+      self._write('[Diff truncated at %s.]\n' % truncated)
+      break
 
 
 class Repository:
   "Hold roots and other information about the repository."
 
-  def __init__(self, repos_dir, rev, pool):
+  def __init__(self, repos_dir, rev, pool, repos_ptr=None):
     self.repos_dir = repos_dir
     self.rev = rev
     self.pool = pool
 
-    self.repos_ptr = svn.repos.open(repos_dir, pool)
+    if repos_ptr is None:
+      repos_ptr = svn.repos.open(repos_dir, pool)
+    self.repos_ptr = repos_ptr
     self.fs_ptr = svn.repos.fs(self.repos_ptr)
 
+    # Roots are allocated in POOL, so forgetting one wouldn't free it;
+    # keep them all.
     self.roots = { }
+    self.root_hits = self.root_misses = 0
+
+    # rev -> all of its revprops, as most changed files ask for the dates
+    # of a handful of base revisions.
+    self.revprops = _LRUCache(self.REVPROPS_CACHE_SIZE)
 
     self.root_this = self.get_root(rev)
 
     self.author = self.get_rev_prop(svn.core.SVN_PROP_REVISION_AUTHOR)
 
+  # How many revisions' revprops to keep.
+  REVPROPS_CACHE_SIZE = 1000
+
   def get_rev_prop(self, propname, rev = None):
     if not rev:
       rev = self.rev
-    return svn.fs.revision_prop(self.fs_ptr, rev, propname, self.pool)
+    props = self.revprops.get(rev)
+    if props is None:
+      props = svn.fs.revision_proplist(self.fs_ptr, rev, self.pool)
+      self.revprops.put(rev, props)
+    return props.get(propname)
 
   def get_root(self, rev):
     try:
-      return self.roots[rev]
+      root = self.roots[rev]
+      self.root_hits = self.root_hits + 1
+      return root
     except KeyError:
       pass
+    self.root_misses = self.root_misses + 1
     root = self.roots[rev] = svn.fs.revision_root(self.fs_ptr, rev, self.pool)
     return root
 
+  def cache_stats(self):
+    "Describe how well the caches did, for debugging."
+    return 'roots: %d hits, %d misses; revprops: %d hits, %d misses' \
+           % (self.root_hits, self.root_misses,
+              self.revprops.hits, self.revprops.misses)
+
+
+class _LRUCache:
+  "A mapping of limited size that forgets the least recently used items."
+
+  def __init__(self, size):
+    self.size = size
+    self.items = collections.OrderedDict()
+    self.hits = self.misses = 0
+
+  def get(self, key):
+    "Return the value for KEY, or None."
+    try:
+      value = self.items.pop(key)
+    except KeyError:
+      self.misses = self.misses + 1
+      return None
+    self.hits = self.hits + 1
+    self.items[key] = value
+    return value
+
+  def put(self, key, value):
+    self.items.pop(key, None)
+    if len(self.items) >= self.size:
+      self.items.popitem(last=False)
+    self.items[key] = value
+
 
 class Config:
 
@@ -1170,13 +1847,36 @@ class Config:
   _predefined = ('general', 'defaults', 'maps')
 
   def __init__(self, fname, repos, global_params):
-    cp = configparser.ConfigParser()
-    cp.read(fname)
+    # these params are always available, although they may be overridden
+    self._global_params = global_params.copy()
+
+    cache = ConfigCache(fname, repos.repos_dir)
+    state = cache.load()
+    if state is None:
+      cp = configparser.ConfigParser()
+      cp.read(fname)
+      sections = [ ]
+      for section in cp.sections():
+        # get the raw value -- we use the same format for *our* interpolation
+        sections.append((section, [(option, cp.get(section, option, raw=1))
+                                   for option in cp.options(section)]))
+      self._load_sections(sections)
+      default_captures, resolved = self._resolve_groups(repos)
+      cache.save((sections, default_captures, resolved))
+    else:
+      sections, default_captures, resolved = state
+      self._load_sections(sections)
+
+    # process all the group sections.
+    self._prep_groups(default_captures, resolved)
+
+  def _load_sections(self, sections):
+    "Set up the sub-sections from a list of (section, [(option, value)])."
 
     # record the (non-default) groups that we find
     self._groups = [ ]
 
-    for section in cp.sections():
+    for section, options in sections:
       if not hasattr(self, section):
         section_ob = _sub_section()
         setattr(self, section, section_ob)
@@ -1184,9 +1884,7 @@ class Config:
           self._groups.append(section)
       else:
         section_ob = getattr(self, section)
-      for option in cp.options(section):
-        # get the raw value -- we use the same format for *our* interpolation
-        value = cp.get(section, option, raw=1)
+      for option, value in options:
         setattr(section_ob, option, value)
 
     # be compatible with old format config files
@@ -1195,15 +1893,9 @@ class Config:
     if not hasattr(self, 'maps'):
       self.maps = _sub_section()
 
-    # these params are always available, although they may be overridden
-    self._global_params = global_params.copy()
-
     # prepare maps. this may remove sections from consideration as a group.
     self._prep_maps()
 
-    # process all the group sections.
-    self._prep_groups(repos)
-
   def is_set(self, option):
     """Return None if the option is not set; otherwise, its value is returned.
 
@@ -1253,6 +1945,13 @@ class Config:
       cmd.append(part % args)
     return cmd
 
+  def is_plain_diff(self, group):
+    """Return whether the diff command of GROUP is a plain unified diff
+    with the two labels, as in the example config."""
+    diff_cmd = (self.get('diff', group, None) or '').split()
+    return bool(diff_cmd) and os.path.basename(diff_cmd[0]) == 'diff' \
+           and diff_cmd[1:] == _PLAIN_DIFF_ARGS
+
   def _prep_maps(self):
     "Rewrite the [maps] options into callables that look up values."
 
@@ -1290,46 +1989,79 @@ class Config:
       self._groups.remove(sectname)
 
 
-  def _prep_groups(self, repos):
-    self._group_re = [ ]
+  def _resolve_groups(self, repos):
+    """Select the groups that apply to REPOS. Return the parameters that
+    the defaults' for_repos extracts, and a list of (group, for_paths,
+    exclude_paths, captured params, search_logmsg) for each group."""
 
     repos_dir = os.path.abspath(repos.repos_dir)
 
-    # compute the default repository-based parameters. start with some
-    # basic parameters, then bring in the regex-based params.
-    self._default_params = self._global_params
+    # compute the default repository-based parameters.
+    default_captures = { }
 
     try:
       match = re.match(self.defaults.for_repos, repos_dir)
       if match:
-        self._default_params = self._default_params.copy()
-        self._default_params.update(match.groupdict())
+        default_captures = match.groupdict()
     except AttributeError:
       # there is no self.defaults.for_repos
       pass
 
     # select the groups that apply to this repository
+    resolved = [ ]
     for group in self._groups:
       sub = getattr(self, group)
-      params = self._default_params
+      captures = default_captures
       if hasattr(sub, 'for_repos'):
         match = re.match(sub.for_repos, repos_dir)
         if not match:
           continue
-        params = params.copy()
-        params.update(match.groupdict())
+        captures = captures.copy()
+        captures.update(match.groupdict())
 
       # if a matching rule hasn't been given, then use the empty string
       # as it will match all paths
-      for_paths = getattr(sub, 'for_paths', '')
-      exclude_paths = getattr(sub, 'exclude_paths', None)
+      resolved.append((group,
+                       getattr(sub, 'for_paths', ''),
+                       getattr(sub, 'exclude_paths', None),
+                       captures,
+                       getattr(sub, 'search_logmsg', None)))
+
+    # after all the groups are done, add in the default group
+    try:
+      resolved.append((None, self.defaults.for_paths, None,
+                       default_captures, None))
+    except AttributeError:
+      # there is no self.defaults.for_paths
+      pass
+
+    return default_captures, resolved
+
+  def _prep_groups(self, default_captures, resolved):
+    "Compile the groups returned by _resolve_groups()."
+
+    self._group_re = [ ]
+
+    # start with some basic parameters, then bring in the regex-based params.
+    self._default_params = self._global_params
+    if default_captures:
+      self._default_params = self._default_params.copy()
+      self._default_params.update(default_captures)
+
+    for group, for_paths, exclude_paths, captures, search_logmsg \
+        in resolved:
+      if captures == default_captures:
+        params = self._default_params
+      else:
+        params = self._global_params.copy()
+        params.update(captures)
+
       if exclude_paths:
         exclude_paths_re = re.compile(exclude_paths)
       else:
         exclude_paths_re = None
 
       # check search_logmsg re
-      search_logmsg = getattr(sub, 'search_logmsg', None)
       if search_logmsg is not None:
         search_logmsg_re = re.compile(search_logmsg)
       else:
@@ -1341,27 +2073,78 @@ class Config:
                              params,
                              search_logmsg_re))
 
-    # after all the groups are done, add in the default group
+    # A for_paths pattern can only match paths that start with its literal
+    # prefix, so index the groups by that prefix. Most paths are then only
+    # matched against the few groups that might apply.
+    self._prefixes = { }
+    for idx in range(len(self._group_re)):
+      prefix = _literal_prefix(self._group_re[idx][1])
+      self._prefixes.setdefault(prefix, [ ]).append(idx)
+
+    # directory ('' or ending in '/') -> (candidates decided by the
+    # directory alone, [(longer prefix, candidates), ...])
+    self._dir_candidates = { }
+
+    # the search_logmsg matches of each group for self._logmsg
+    self._logmsg = None
+    self._logmsg_matches = { }
+
+  def _candidates(self, path):
+    "Return the indexes in _group_re of the groups that may match PATH."
+    dirname = path[:path.rfind('/') + 1]
     try:
-      self._group_re.append((None,
-                             re.compile(self.defaults.for_paths),
-                             None,
-                             self._default_params,
-                             None))
-    except AttributeError:
-      # there is no self.defaults.for_paths
-      pass
+      fixed, longer = self._dir_candidates[dirname]
+    except KeyError:
+      fixed = [ ]
+      longer = [ ]
+      for prefix, indexes in self._prefixes.items():
+        if len(prefix) <= len(dirname):
+          if dirname.startswith(prefix):
+            fixed.extend(indexes)
+        elif prefix.startswith(dirname):
+          longer.append((prefix, indexes))
+      fixed.sort()
+      self._dir_candidates[dirname] = fixed, longer
+
+    if not longer:
+      return fixed
+    candidates = fixed[:]
+    for prefix, indexes in longer:
+      if path.startswith(prefix):
+        candidates.extend(indexes)
+    candidates.sort()
+    return candidates
+
+  def _search_logmsg(self, idx, search_logmsg_re, logmsg):
+    "Return the groupdicts of SEARCH_LOGMSG_RE's matches in LOGMSG."
+    if logmsg != self._logmsg:
+      self._logmsg = logmsg
+      self._logmsg_matches = { }
+    try:
+      return self._logmsg_matches[idx]
+    except KeyError:
+      matches = [match.groupdict()
+                 for match in search_logmsg_re.finditer(logmsg)]
+      self._logmsg_matches[idx] = matches
+      return matches
 
   def which_groups(self, path, logmsg):
     "Return the path's associated groups."
     groups = []
-    for group, pattern, exclude_pattern, repos_params, search_logmsg_re in self._group_re:
+    for idx in self._candidates(path):
+      group, pattern, exclude_pattern, repos_params, search_logmsg_re = \
+        self._group_re[idx]
       match = pattern.match(path)
       if match:
         if exclude_pattern and exclude_pattern.match(path):
           continue
-        params = repos_params.copy()
-        params.update(match.groupdict())
+        # the params are only read, so share them unless there is
+        # something to add
+        params = repos_params
+        captured = match.groupdict()
+        if captured:
+          params = params.copy()
+          params.update(captured)
 
         if search_logmsg_re is None:
           groups.append((group, params))
@@ -1369,10 +2152,10 @@ class Config:
           if logmsg is None:
             logmsg = ''
 
-          for match in search_logmsg_re.finditer(logmsg):
+          for captured in self._search_logmsg(idx, search_logmsg_re, logmsg):
             # Add captured variables to (a copy of) params
             msg_params = params.copy()
-            msg_params.update(match.groupdict())
+            msg_params.update(captured)
             groups.append((group, msg_params))
 
     if not groups:
@@ -1381,6 +2164,114 @@ class Config:
     return groups
 
 
+class ConfigCache:
+  """The parsed form of a config file, as used for one repository, kept on
+  disk so that each hook run need not parse the config file again.
+
+  The cache records the config file's mtime, size and SHA-1, and is
+  ignored if any of them changed. The cache file is readable by its owner
+  only. Any failure to read or write the cache just means that the config
+  file gets parsed."""
+
+  # Bump this when the cached data changes shape.
+  VERSION = 1
+
+  # cache file -> (key, state) of what this process loaded or saved, so a
+  # long-running process need not even read the cache file again.
+  _loaded = { }
+
+  def __init__(self, fname, repos_dir):
+    self.fname = os.path.abspath(fname)
+    repos_dir = os.path.abspath(repos_dir)
+    cache_dir = os.environ.get('MAILER_CACHE_DIR') \
+                or os.path.dirname(self.fname)
+    tag = hashlib.sha1(repos_dir.encode('utf-8')).hexdigest()[:16]
+    self.path = os.path.join(cache_dir, '.%s.%s.cache'
+                             % (os.path.basename(self.fname), tag))
+    self.key = None
+    try:
+      st = os.stat(self.fname)
+      digest = hashlib.sha1(open(self.fname, 'rb').read()).hexdigest()
+    except (IOError, OSError):
+      return
+    self.key = (self.VERSION, sys.version, self.fname, repos_dir,
+                int(st.st_mtime), st.st_size, digest)
+
+  def load(self):
+    "Return the cached state, or None."
+    if self.key is None:
+      return None
+    key, state = self._loaded.get(self.path, (None, None))
+    if key == self.key:
+      return state
+    try:
+      f = open(self.path, 'rb')
+      try:
+        key, state = marshal.load(f)
+      finally:
+        f.close()
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+      return None
+    if key != self.key:
+      return None
+    self._loaded[self.path] = (key, state)
+    return state
+
+  def save(self, state):
+    if self.key is None:
+      return
+    self._loaded[self.path] = (self.key, state)
+    tmp = '%s.%d' % (self.path, os.getpid())
+    try:
+      # the state holds every raw option, passwords included
+      f = os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL
+                            | getattr(os, 'O_BINARY', 0), 0o600), 'wb')
+      try:
+        marshal.dump((self.key, state), f)
+      finally:
+        f.close()
+      # a reader sees either the old cache or the new one
+      os.rename(tmp, self.path)
+    except (IOError, OSError, ValueError):
+      try:
+        os.remove(tmp)
+      except OSError:
+        pass
+
+
+def _literal_prefix(regex):
+  """Return the literal text that anything matched by the compiled
+  REGEX (with match(), not search()) must start with; maybe ''."""
+  if regex.flags & (re.IGNORECASE | re.VERBOSE):
+    return ''
+  pattern = regex.pattern
+  if '|' in pattern:
+    # a top-level alternation would make any prefix optional
+    return ''
+  prefix = [ ]
+  i = 0
+  if pattern[:1] == '^':
+    i = 1
+  while i < len(pattern):
+    c = pattern[i]
+    if c == '\\':
+      escaped = pattern[i+1:i+2]
+      if not escaped or escaped.isalnum() or escaped == '_':
+        # a character class, anchor or backreference
+        break
+      prefix.append(escaped)
+      i = i + 2
+    elif c in '.^$*+?{}[]()':
+      if c in '*?{' and prefix:
+        # the last character is optional or repeated
+        prefix.pop()
+      break
+    else:
+      prefix.append(c)
+      i = i + 1
+  return ''.join(prefix)
+
+
 class _sub_section:
   pass
 
@@ -1420,15 +2311,6 @@ if the property was added, modified or deleted, respectively.
 """ % (scriptname, scriptname, scriptname, scriptname, scriptname))
     sys.exit(1)
 
-  # Command list:  subcommand -> number of arguments expected (not including
-  #                              the repository directory and config-file)
-  cmd_list = {'commit'     : 1,
-              'propchange' : 3,
-              'propchange2': 4,
-              'lock'       : 1,
-              'unlock'     : 1,
-              }
-
   config_fname = None
   argc = len(sys.argv)
   if argc < 3:
@@ -1450,16 +2332,15 @@ if the property was added, modified or deleted, respectively.
 
   # Settle on a config file location, and open it.
   if config_fname is None:
-    # Default to REPOS-DIR/conf/mailer.conf.
-    config_fname = os.path.join(repos_dir, 'conf', 'mailer.conf')
-    if not os.path.exists(config_fname):
-      # Okay.  Look for 'mailer.conf' as a sibling of this script.
-      config_fname = os.path.join(os.path.dirname(sys.argv[0]), 'mailer.conf')
+    config_fname = find_config(repos_dir)
   if not os.path.exists(config_fname):
     raise MissingConfig(config_fname)
 
-  svn.core.run_app(main, cmd, config_fname, repos_dir,
-                   sys.argv[3:3+expected_args])
+  try:
+    svn.core.run_app(main, cmd, config_fname, repos_dir,
+                     sys.argv[3:3+expected_args])
+  finally:
+    close_smtp_sessions()
 
 # ------------------------------------------------------------------------
 # TODO
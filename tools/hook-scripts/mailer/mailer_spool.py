@@ -0,0 +1,109 @@
+#
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+#
+# mailer_spool.py: the spool directory shared by mailer-enqueue.py and
+#                  mailer-daemon.py
+#
+#   A job is a file NAME.job with one mailer.py argument per line, where
+#   the NAMEs sort in order of arrival. The hook's standard input, if
+#   the command reads it, is saved next to it as NAME.stdin. The daemon
+#   is woken up by a datagram to the socket SOCKET_NAME.
+#
+#   This module doesn't load the Subversion bindings, so that
+#   mailer-enqueue.py stays cheap enough to run from the hooks.
+#
+
+import os
+import time
+import socket
+import itertools
+
+# The daemon's wake-up socket, inside the spool directory.
+SOCKET_NAME = 'socket'
+
+# The commands for which mailer.py reads the hook's standard input.
+STDIN_COMMANDS = ('propchange2', 'lock', 'unlock')
+
+JOB_SUFFIX = '.job'
+STDIN_SUFFIX = '.stdin'
+
+# Keeps the names of jobs queued by one process apart.
+_job_counter = itertools.count()
+
+
+def enqueue(spool_dir, args, stdin=None):
+  """Write a job running mailer.py with ARGS into SPOOL_DIR, saving STDIN
+  with it if it is not None."""
+  name = '%020.6f-%d-%d' % (time.time(), os.getpid(), next(_job_counter))
+  if stdin is not None:
+    # written before the job, so the daemon never sees a job without it
+    f = open(os.path.join(spool_dir, name + STDIN_SUFFIX), 'wb')
+    f.write(stdin)
+    f.close()
+  tmp = os.path.join(spool_dir, name + '.tmp')
+  f = open(tmp, 'w')
+  f.write('\n'.join(args) + '\n')
+  f.close()
+  os.rename(tmp, os.path.join(spool_dir, name + JOB_SUFFIX))
+
+
+def wake(spool_dir):
+  "Tell the daemon there is work; never fail if it isn't listening."
+  try:
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+      s.sendto(b'.', os.path.join(spool_dir, SOCKET_NAME))
+    finally:
+      s.close()
+  except socket.error:
+    pass
+
+
+def jobs(spool_dir):
+  "Return the names of the jobs in SPOOL_DIR, oldest first."
+  return sorted([name[:-len(JOB_SUFFIX)] for name in os.listdir(spool_dir)
+                 if name.endswith(JOB_SUFFIX)])
+
+
+def job_files(spool_dir, name):
+  "Return the names of the files in SPOOL_DIR that make up the job NAME."
+  files = [ name + JOB_SUFFIX ]
+  if os.path.exists(os.path.join(spool_dir, name + STDIN_SUFFIX)):
+    files.append(name + STDIN_SUFFIX)
+  return files
+
+
+def read_job(spool_dir, name):
+  """Return the arguments of the job NAME in SPOOL_DIR, and its standard
+  input or None."""
+  f = open(os.path.join(spool_dir, name + JOB_SUFFIX))
+  try:
+    args = f.read().split('\n')[:-1]
+  finally:
+    f.close()
+  stdin = None
+  path = os.path.join(spool_dir, name + STDIN_SUFFIX)
+  if os.path.exists(path):
+    f = open(path)
+    try:
+      stdin = f.read()
+    finally:
+      f.close()
+  return args, stdin
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+#
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+#
+#
+# mailer-diff-cache.py: test the sharing of diffs between the bodies of
+#                       one commit's messages
+#
+# USAGE: ./mailer-diff-cache.py
+#
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mailer
+
+import svn.core
+import svn.repos
+
+
+class Config:
+  def get(self, option, group, params):
+    return None
+
+  def is_plain_diff(self, group):
+    return True
+
+
+class Repository:
+  rev = 2
+  root_this = None
+
+
+class Selections:
+  add = copy = delete = modify = True
+
+
+class URLSelections:
+  def get_add_url(self, repos_rev, change):
+    return None
+
+
+class Budget:
+  "A message that is full after FULL_AFTER diffs."
+
+  max_diff_size = 0
+  max_message_size = 100
+
+  def __init__(self, full_after=None):
+    self.full_after = full_after
+    self.diffs = 0
+
+  def message_full(self):
+    return self.full_after is not None and self.diffs >= self.full_after
+
+
+class DiffGenerator(mailer.DiffGenerator):
+  "Counts the diffs it makes instead of running a diff."
+
+  made = [ ]
+
+  def _generate_diff(self, diff, label1, label2):
+    self.made.append(diff.path2)
+    self.budget.diffs = self.budget.diffs + 1
+    return False, None, None, iter(['+%s\n' % diff.path2]), None
+
+
+class DiffCacheTests(unittest.TestCase):
+
+  def setUp(self):
+    self.paths = [ 'f1', 'f2', 'f3' ]
+    self.changelist = mailer.ChangeList([
+      svn.repos.ChangedPath(svn.core.svn_node_file, False, True, None, -1,
+                            path, True, svn.repos.CHANGE_ACTION_ADD)
+      for path in self.paths ])
+    # as Commit.generate() makes it for two bodies showing every file
+    self.diff_cache = dict([(path, [2, { }]) for path in self.paths])
+    DiffGenerator.made = [ ]
+
+  def render(self, budget):
+    diffs = DiffGenerator(self.changelist, dict.fromkeys(self.paths), True,
+                          Config(), Repository(), 'date', 'group', { },
+                          Selections(), URLSelections(), budget, None,
+                          self.diff_cache)
+    return [ (item.path, item.content and list(item.content))
+             for item in diffs ]
+
+  def test_shared(self):
+    first = self.render(Budget())
+    self.assertEqual(self.render(Budget()), first)
+    self.assertEqual(DiffGenerator.made, self.paths)
+    self.assertEqual(self.diff_cache, { })
+
+  def test_truncated_body(self):
+    # The first body is full after one diff and skips the other files,
+    # which the second body then need not keep for anyone.
+    self.render(Budget(full_after=1))
+    self.assertEqual([ (path, self.diff_cache[path][0],
+                        len(self.diff_cache[path][1]))
+                       for path in self.paths ],
+                     [ ('f1', 1, 1), ('f2', 1, 0), ('f3', 1, 0) ])
+    self.assertEqual(self.render(Budget()),
+                     [ (path, [ '+%s\n' % path ]) for path in self.paths ])
+    self.assertEqual(DiffGenerator.made, self.paths)
+    self.assertEqual(self.diff_cache, { })
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -39,6 +39,8 @@
 #    6. Create bzipped dump files.
 #    7. Transfer the dumpfile to another host using ftp.
 #    8. Transfer the dumpfile to another host using smb.
+#    9. Dump several repositories or revision ranges concurrently.
+#   10. Create xz or zstd compressed, indexed dump files.
 #
 # See also 'svn-backup-dumps.py -h'.
 #
@@ -143,6 +145,62 @@
 #    repository name (basename of the repository path).
 #
 #
+# 9. Dump several repositories or revision ranges concurrently.
+#
+#    svn-backup-dumps.py -j <jobs> [--compress-jobs <procs>] \
+#                        <repos>... <dumpdir>
+#
+#    <jobs>       Count of 'svnadmin dump' processes to run at once.
+#    <procs>      Count of processes compressing for -z and -b
+#                 (default: the count of CPUs with -j, else none).
+#    <repos>      Paths to the repositories.
+#    <dumpdir>    Directory for storing the dump files.
+#    ...          More options, see 1-8.
+#
+#    Each dump file to write is a job: one per repository, or one per
+#    missing chunk of <count> revisions with -c. The jobs run <jobs> at
+#    a time, and as each one finishes its throughput is reported.
+#
+#    With --compress-jobs, -z and -b compress the dump in blocks of
+#    4 MB, each in one of <procs> processes. The blocks are written as
+#    consecutive gzip members or bzip2 streams, which gunzip, bunzip2
+#    and Python 3 read as one file.
+#
+#
+# 10. Create xz or zstd compressed, indexed dump files.
+#
+#    svn-backup-dumps.py -x ...
+#    svn-backup-dumps.py --zstd ...
+#    svn-backup-dumps.py --cat-from <revnr> <dumpfile> | svnadmin load ...
+#
+#    <revnr>      A revision number in <dumpfile>.
+#    <dumpfile>   A dump file created with -x or --zstd.
+#    ...          More options, see 1-4, 7-9.
+#
+#    The dump is compressed in independent 4 MB blocks, in as many
+#    processes as there are CPUs unless --compress-jobs says otherwise,
+#    and written as consecutive xz streams or zstd frames, which xz and
+#    zstd read as one file. -x needs the lzma module (Python 3.3, or
+#    backports.lzma) and --zstd the zstandard module.
+#
+#    The file '<dumpfile>.index' records where each block and each
+#    revision starts. With it, --cat-from writes the dump's header and
+#    then the dump from <revnr> on, decompressing only the blocks that
+#    hold these.
+#
+#
+# Every dump file written is recorded in the manifest
+# <dumpdir>/svn-backup-dumps.json, with the UUID of its repository, its
+# revision range, its size and the SHA-1 checksum of the dump it holds.
+# A run finding HEAD already dumped does nothing more, and
+#
+#    svn-backup-dumps.py --verify <repos>... <dumpdir>
+#
+# checks, from the manifest alone, that the dump files of each
+# repository are present and of the recorded size and that their ranges
+# cover every revision up to the last one dumped.
+#
+#
 #
 # TODO:
 #  - find out how to report smbclient errors
@@ -159,16 +217,53 @@ if os.name != "nt":
 import gzip
 import os.path
 import re
+import time
+import hashlib
+import threading
+from collections import deque
+from io import BytesIO
 from optparse import OptionParser
 from ftplib import FTP
 from subprocess import Popen, PIPE
 
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
 try:
     import bz2
     have_bz2 = True
 except ImportError:
     have_bz2 = False
 
+try:
+    import lzma
+    have_lzma = True
+except ImportError:
+    try:
+        from backports import lzma
+        have_lzma = True
+    except ImportError:
+        have_lzma = False
+
+try:
+    import zstandard
+    have_zstd = True
+except ImportError:
+    have_zstd = False
+
+try:
+    import multiprocessing
+    have_multiprocessing = True
+except ImportError:
+    have_multiprocessing = False
+
 
 class SvnBackupOutput:
 
@@ -176,6 +271,9 @@ class SvnBackupOutput:
         self.__filename = filename
         self.__absfilename = os.path.join(abspath, filename)
 
+    def get_index_filename(self):
+        return None
+
     def open(self):
         pass
 
@@ -240,6 +338,213 @@ class SvnBackupOutputBzip2(SvnBackupOutput):
         self.__ofd.write(self.__compressor.flush())
         self.__ofd.close()
 
+
+def compress_block(compression, data):
+    # Runs in a worker process of the compression pool.
+    if compression == "gzip":
+        buf = BytesIO()
+        compressor = gzip.GzipFile(fileobj=buf, mode="wb")
+        compressor.write(data)
+        compressor.close()
+        return buf.getvalue()
+    elif compression == "bzip2":
+        return bz2.compress(data)
+    elif compression == "xz":
+        return lzma.compress(data, format=lzma.FORMAT_XZ)
+    else:
+        return zstandard.ZstdCompressor().compress(data)
+
+
+def decompress_block(compression, data):
+    if compression == "xz":
+        return lzma.decompress(data, format=lzma.FORMAT_XZ)
+    else:
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+
+block_extensions = { "gzip": ".gz", "bzip2": ".bz2", "xz": ".xz",
+                     "zstd": ".zst" }
+
+
+class SvnBackupDumpScanner:
+    """Find where the revision records start in a dump stream fed to it
+    in pieces, skipping over the contents of the records."""
+
+    def __init__(self):
+        # the offset in the stream of the next data fed
+        self.offset = 0
+        # [ (revision, offset), ... ]
+        self.revisions = []
+        self.__partial = ""
+        self.__in_headers = False
+        self.__content_length = 0
+        self.__skip = 0
+
+    def feed(self, data):
+        pos = 0
+        end = len(data)
+        while pos < end:
+            if self.__skip:
+                n = min(self.__skip, end - pos)
+                self.__skip -= n
+                pos += n
+                continue
+            nl = data.find("\n", pos)
+            if nl == -1:
+                self.__partial += data[pos:]
+                break
+            line = self.__partial + data[pos:nl]
+            line_offset = self.offset + pos - len(self.__partial)
+            self.__partial = ""
+            pos = nl + 1
+            if not line:
+                if self.__in_headers:
+                    self.__in_headers = False
+                    self.__skip = self.__content_length
+                    self.__content_length = 0
+            elif not self.__in_headers:
+                self.__in_headers = True
+                if line.startswith("Revision-number: "):
+                    self.revisions.append((int(line[17:]), line_offset))
+            if line.startswith("Content-length: "):
+                self.__content_length = int(line[16:])
+        self.offset += end
+
+
+class SvnBackupOutputParallel(SvnBackupOutput):
+    """Compress in blocks of block_size bytes, in a multiprocessing pool
+    if one is given. Each block becomes a complete gzip member, bzip2 or
+    xz stream or zstd frame, and the blocks are written in order.
+
+    For xz and zstd an index is written next to the file, in JSON, to
+    allow reading the dump from any revision (see cat_dump_from()):
+
+    { "compression": "xz" or "zstd",
+      "blocks": [ [ OFFSET, SIZE, COMPRESSED-OFFSET, COMPRESSED-SIZE ],
+                  ... ],
+      "revisions": [ [ REVISION, OFFSET ], ... ] }
+    """
+
+    block_size = 4 * 1024 * 1024
+
+    def __init__(self, abspath, filename, compression, pool, max_pending):
+        SvnBackupOutput.__init__(self, abspath,
+                                 filename + block_extensions[compression])
+        self.__compression = compression
+        self.__pool = pool
+        # keep at most this many blocks in memory, waiting for the pool
+        self.__max_pending = max_pending
+        self.__indexed = compression in [ "xz", "zstd" ]
+
+    def get_index_filename(self):
+        if self.__indexed:
+            return self.get_filename() + ".index"
+        return None
+
+    def open(self):
+        self.__ofd = open(self.get_absfilename(), "wb")
+        self.__buffer = []
+        self.__buffered = 0
+        self.__pending = deque()
+        self.__blocks = []
+        self.__offset = 0
+        self.__compressed_offset = 0
+        self.__scanner = None
+        if self.__indexed:
+            self.__scanner = SvnBackupDumpScanner()
+
+    def write(self, data):
+        self.__buffer.append(data)
+        self.__buffered += len(data)
+        if self.__scanner:
+            self.__scanner.feed(data)
+        if self.__buffered >= self.block_size:
+            self.__submit()
+
+    def __submit(self):
+        data = "".join(self.__buffer)
+        self.__buffer = []
+        self.__buffered = 0
+        if self.__pool:
+            self.__pending.append((len(data),
+                    self.__pool.apply_async(compress_block,
+                                            (self.__compression, data))))
+            while len(self.__pending) > self.__max_pending:
+                self.__write_block(*self.__pending.popleft())
+        else:
+            self.__write_block(len(data),
+                               compress_block(self.__compression, data))
+
+    def __write_block(self, size, compressed):
+        if not isinstance(compressed, str):
+            compressed = compressed.get()
+        self.__ofd.write(compressed)
+        self.__blocks.append([ self.__offset, size,
+                               self.__compressed_offset, len(compressed) ])
+        self.__offset += size
+        self.__compressed_offset += len(compressed)
+
+    def close(self):
+        if self.__buffered or not (self.__blocks or self.__pending):
+            self.__submit()
+        while self.__pending:
+            self.__write_block(*self.__pending.popleft())
+        self.__ofd.close()
+        if self.__indexed:
+            ofd = open(self.get_absfilename() + ".index", "wb")
+            json.dump({ "compression": self.__compression,
+                        "blocks": self.__blocks,
+                        "revisions": self.__scanner.revisions }, ofd)
+            ofd.close()
+
+
+def cat_dump_from(absfilename, rev, output):
+    """Write the dump in ABSFILENAME, which SvnBackupOutputParallel
+    wrote with an index, to OUTPUT from revision REV on: the dump's
+    header, then the records of REV and later revisions. Only the blocks
+    holding these are read."""
+    ifd = open(absfilename + ".index", "rb")
+    index = json.load(ifd)
+    ifd.close()
+    compression = index["compression"]
+    blocks = index["blocks"]
+    revisions = index["revisions"]
+    if not revisions:
+        raise SvnBackupException("'%s' holds no revisions." % absfilename)
+    offset = None
+    for revision, revision_offset in revisions:
+        if revision == rev:
+            offset = revision_offset
+            break
+    if offset == None:
+        raise SvnBackupException("'%s' holds revisions %d to %d, not %d."
+                                 % (absfilename, revisions[0][0],
+                                    revisions[-1][0], rev))
+
+    ifd = open(absfilename, "rb")
+    def read_block(block):
+        ifd.seek(block[2])
+        return decompress_block(compression, ifd.read(block[3]))
+
+    # the dump format version and the UUID come before the first revision
+    header_size = revisions[0][1]
+    i = 0
+    while header_size > 0:
+        data = read_block(blocks[i])[:header_size]
+        output.write(data)
+        header_size -= len(data)
+        i += 1
+
+    for block in blocks:
+        if block[0] + block[1] <= offset:
+            continue
+        data = read_block(block)
+        if block[0] < offset:
+            data = data[offset - block[0]:]
+        output.write(data)
+    ifd.close()
+
+
 class SvnBackupOutputCommand(SvnBackupOutput):
 
     def __init__(self, abspath, filename, file_extension, cmd_path,
@@ -253,7 +558,9 @@ class SvnBackupOutputCommand(SvnBackupOutput):
 
         self.__ofd = open(self.get_absfilename(), "wb")
         try:
-            proc = Popen(cmd, stdin=PIPE, stdout=self.__ofd, shell=False)
+            # no other job's svnadmin may inherit our stdin pipe
+            proc = Popen(cmd, stdin=PIPE, stdout=self.__ofd, shell=False,
+                         close_fds=(os.name != "nt"))
         except:
             print (256, "", "Popen failed (%s ...):\n  %s" % (cmd[0],
                     str(sys.exc_info()[1])))
@@ -269,6 +576,156 @@ class SvnBackupOutputCommand(SvnBackupOutput):
         rc = self.__proc.wait()
         self.__ofd.close()
 
+class SvnBackupMeter:
+
+    def __init__(self, output):
+        self.output = output
+        self.bytes = 0
+        self.sha1 = hashlib.sha1()
+
+    def write(self, data):
+        self.bytes += len(data)
+        self.sha1.update(data)
+        self.output.write(data)
+
+class SvnBackupManifest:
+    """The record of the dump files in a dumpdir, kept in a JSON file:
+
+    { "repositories": { REPOSNAME: { "uuid": UUID,
+                                     "dumps": { FILENAME: DUMP, ... } } } }
+
+    where each DUMP has the keys "from" and "to" (the revision range),
+    "bytes" (the size of the dump), "size" (the size of the file) and
+    "sha1" (the checksum of the dump), and "single" if it is a -r export,
+    which is not part of the chain of dumps from r0."""
+
+    filename = "svn-backup-dumps.json"
+
+    def __init__(self, dumpdir):
+        self.__dumpdir = dumpdir
+        self.__path = os.path.join(dumpdir, self.filename)
+        self.__lock = threading.Lock()
+        self.__repositories = self.__load()
+        # reposname -> the revision dumped last, once worked out
+        self.__last = {}
+
+    def __load(self):
+        try:
+            ifd = open(self.__path, "rb")
+        except IOError:
+            return {}
+        try:
+            try:
+                return json.load(ifd)["repositories"]
+            except (ValueError, KeyError):
+                raise SvnBackupException("manifest '%s' is corrupt."
+                                         % self.__path)
+        finally:
+            ifd.close()
+
+    def get_uuid(self, reposname):
+        repos = self.__repositories.get(reposname)
+        return repos and repos["uuid"]
+
+    def get_dumps(self, reposname):
+        repos = self.__repositories.get(reposname)
+        if not repos:
+            return {}
+        return repos["dumps"]
+
+    def get_chain(self, reposname):
+        """Return the dumps of REPOSNAME that belong to the chain from r0,
+        as (filename, dump) pairs, ordered by their ranges."""
+        dumps = self.get_dumps(reposname)
+        chain = [ (name, dump) for name, dump in dumps.items()
+                  if not dump.get("single") ]
+        chain.sort(key=lambda item: (item[1]["from"], item[1]["to"]))
+        return chain
+
+    def check_file(self, name, dump):
+        """Return what is wrong with the file NAME of DUMP, or None."""
+        absname = os.path.join(self.__dumpdir, name)
+        if not os.path.exists(absname):
+            return "%s is missing." % name
+        size = os.path.getsize(absname)
+        if size != dump["size"]:
+            return "%s has %d bytes, not %d." % (name, size, dump["size"])
+        return None
+
+    def get_last_dumped_rev(self, reposname):
+        """Return the last revision of REPOSNAME that the chain covers
+        without a gap from r0, or -1.  Dumps whose files are missing or
+        have the wrong size do not count."""
+        try:
+            return self.__last[reposname]
+        except KeyError:
+            pass
+        last = -1
+        for name, dump in self.get_chain(reposname):
+            if dump["from"] > last + 1:
+                break
+            if self.check_file(name, dump):
+                continue
+            last = max(last, dump["to"])
+        self.__last[reposname] = last
+        return last
+
+    def add_dump(self, reposname, uuid, filename, fromrev, torev, bytes,
+                 size, sha1, single=False):
+        dump = { "from": fromrev, "to": torev, "bytes": bytes,
+                 "size": size, "sha1": sha1 }
+        if single:
+            dump["single"] = True
+        self.__lock.acquire()
+        try:
+            # keep what other runs have recorded since we read the file
+            repositories = self.__load()
+            for name, repos in self.__repositories.items():
+                other = repositories.setdefault(name, repos)
+                if other is not repos:
+                    other["uuid"] = repos["uuid"]
+                    other["dumps"].update(repos["dumps"])
+            repos = repositories.setdefault(reposname,
+                                            { "uuid": uuid, "dumps": {} })
+            repos["uuid"] = uuid
+            repos["dumps"][filename] = dump
+            self.__repositories = repositories
+            self.__last.pop(reposname, None)
+            self.__save()
+        finally:
+            self.__lock.release()
+
+    def __save(self):
+        tmp = "%s.%d.tmp" % (self.__path, os.getpid())
+        ofd = open(tmp, "wb")
+        try:
+            json.dump({ "repositories": self.__repositories }, ofd,
+                      indent=1, sort_keys=True)
+        finally:
+            ofd.close()
+        if os.name == "nt" and os.path.exists(self.__path):
+            os.remove(self.__path)
+        os.rename(tmp, self.__path)
+
+    def verify(self, reposname):
+        """Return a list of the problems with the dumps of REPOSNAME,
+        checking only the files' sizes."""
+        problems = []
+        covered = -1
+        for name, dump in self.get_chain(reposname):
+            if dump["from"] > covered + 1:
+                problems.append("revisions %d-%d are not dumped."
+                                % (covered + 1, dump["from"] - 1))
+            covered = max(covered, dump["to"])
+        dumps = self.get_dumps(reposname)
+        for name in sorted(dumps):
+            problem = self.check_file(name, dumps[name])
+            if problem:
+                problems.append(problem)
+        if covered == -1:
+            problems.append("no dumps are recorded.")
+        return problems
+
 class SvnBackupException(Exception):
 
     def __init__(self, errortext):
@@ -277,9 +734,47 @@ class SvnBackupException(Exception):
     def __str__(self):
         return self.errortext
 
+class SvnBackupJobs:
+
+    def __init__(self, jobs):
+        self.__jobs = jobs
+        self.__queue = queue.Queue()
+        self.__lock = threading.Lock()
+        self.__rc = True
+
+    def add(self, func, *args):
+        self.__queue.put((func, args))
+
+    def run(self):
+        threads = []
+        for i in range(min(self.__jobs, self.__queue.qsize())):
+            thread = threading.Thread(target=self.__worker)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return self.__rc
+
+    def __worker(self):
+        while True:
+            try:
+                func, args = self.__queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                rc = func(*args)
+            except Exception, e:
+                print("svn-backup-dumps.py: %s" % e)
+                rc = False
+            if not rc:
+                self.__lock.acquire()
+                self.__rc = False
+                self.__lock.release()
+
 class SvnBackup:
 
-    def __init__(self, options, args):
+    def __init__(self, options, args, jobs=None, compress_pool=None,
+                 compress_jobs=0, manifest=None):
         # need 3 args: progname, reposname, dumpdir
         if len(args) != 3:
             if len(args) < 3:
@@ -344,9 +839,29 @@ class SvnBackup:
         if options.gzip:
             compress_options = compress_options + 1
             self.__zip = "gzip"
+        if getattr(options, "xz", False):
+            compress_options = compress_options + 1
+            self.__zip = "xz"
+        if getattr(options, "zstd", False):
+            compress_options = compress_options + 1
+            self.__zip = "zstd"
         if compress_options > 1:
-            raise SvnBackupException("--bzip2-path, --gzip-path, -b, -z are "
-                                     "mutually exclusive.")
+            raise SvnBackupException("--bzip2-path, --gzip-path, -b, -z, -x, "
+                                     "--zstd are mutually exclusive.")
+
+        # parallel mode: dumps are queued in jobs, compression may be
+        # done in compress_pool, and each dump's throughput is reported
+        self.__jobs = jobs
+        self.__compress_pool = compress_pool
+        self.__compress_jobs = compress_jobs
+        self.__report = jobs != None or compress_pool != None
+
+        self.__verify = options.verify
+        if manifest == None:
+            manifest = SvnBackupManifest(self.__dumpdir)
+        self.__manifest = manifest
+        self.__uuid = None
+        self.__head_rev = None
 
         self.__overwrite = False
         self.__overwrite_all = False
@@ -378,7 +893,8 @@ class SvnBackup:
 
     def exec_cmd_unix(self, cmd, output=None, printerr=False):
         try:
-            proc = Popen(cmd, stdout=PIPE, stderr=PIPE, shell=False)
+            proc = Popen(cmd, stdout=PIPE, stderr=PIPE, shell=False,
+                         close_fds=True)
         except:
             return (256, "", "Popen failed (%s ...):\n  %s" % (cmd[0],
                     str(sys.exc_info()[1])))
@@ -432,7 +948,50 @@ class SvnBackup:
         rc = proc.wait()
         return (rc, bufout, buferr)
 
+    def read_db_file(self, name):
+        """Return the first line of the file NAME in the db directory of
+        an FSFS repository, or None."""
+        try:
+            dbpath = os.path.join(self.__repospath, "db")
+            if open(os.path.join(dbpath, "fs-type")).read().strip() != "fsfs":
+                return None
+            return open(os.path.join(dbpath, name)).readline()
+        except IOError:
+            return None
+
+    def get_uuid(self):
+        if self.__uuid == None:
+            line = self.read_db_file("uuid")
+            if line:
+                self.__uuid = line.strip()
+            else:
+                cmd = [ self.__svnlook_path, "uuid", self.__repospath ]
+                r = self.exec_cmd(cmd)
+                if r[0] != 0 or len(r[2]) != 0:
+                    raise SvnBackupException("can't get the UUID of '%s':\n%s"
+                                             % (self.__repospath, r[2]))
+                self.__uuid = r[1].strip()
+        return self.__uuid
+
+    def check_uuid(self):
+        recorded = self.__manifest.get_uuid(self.__reposname)
+        if recorded and recorded != self.get_uuid():
+            raise SvnBackupException("the dumps of '%s' in '%s' are of "
+                                     "another repository (UUID %s)."
+                                     % (self.__reposname, self.__dumpdir,
+                                        recorded))
+
     def get_head_rev(self):
+        if self.__head_rev == None:
+            self.__head_rev = self.read_head_rev()
+        return self.__head_rev
+
+    def read_head_rev(self):
+        # db/current starts with the youngest revision; reading it saves
+        # running svnlook for each of many repositories
+        line = self.read_db_file("current")
+        if line:
+            return int(line.split()[0])
         cmd = [ self.__svnlook_path, "youngest", self.__repospath ]
         r = self.exec_cmd(cmd)
         if r[0] == 0 and len(r[2]) == 0:
@@ -442,6 +1001,11 @@ class SvnBackup:
         return -1
 
     def get_last_dumped_rev(self):
+        highest_rev = self.__manifest.get_last_dumped_rev(self.__reposname)
+        if highest_rev != -1:
+            return highest_rev
+
+        # dumps from before the manifest
         filename_regex = re.compile("(.+)\.\d+-(\d+)\.svndmp.*")
         # start with -1 so the next one will be rev 0
         highest_rev = -1
@@ -501,6 +1065,13 @@ class SvnBackup:
         else:
             print("unknown transfer method '%s'." % self.__transfer[0])
 
+    def is_damaged(self, filename):
+        """Return whether the manifest records FILENAME, but the file is not
+        as recorded."""
+        dump = self.__manifest.get_dumps(self.__reposname).get(filename)
+        return dump is not None \
+            and self.__manifest.check_file(filename, dump) is not None
+
     def create_dump(self, checkonly, overwrite, fromrev, torev=None):
         revparam = "%d" % fromrev
         r = "%06d" % fromrev
@@ -516,7 +1087,12 @@ class SvnBackup:
              output = SvnBackupOutputCommand(self.__dumpdir, filename, ".gz",
                                              self.__gzip_path, "-cf" )
         elif self.__zip:
-            if self.__zip == "gzip":
+            if self.__compress_pool or self.__zip in [ "xz", "zstd" ]:
+                output = SvnBackupOutputParallel(self.__dumpdir, filename,
+                                                 self.__zip,
+                                                 self.__compress_pool,
+                                                 2 * self.__compress_jobs)
+            elif self.__zip == "gzip":
                 output = SvnBackupOutputGzip(self.__dumpdir, filename)
             else:
                 output = SvnBackupOutputBzip2(self.__dumpdir, filename)
@@ -524,10 +1100,11 @@ class SvnBackup:
             output = SvnBackupOutputPlain(self.__dumpdir, filename)
         absfilename = output.get_absfilename()
         realfilename = output.get_filename()
+        damaged = self.is_damaged(realfilename)
         if checkonly:
-            return os.path.exists(absfilename)
+            return os.path.exists(absfilename) and not damaged
         elif os.path.exists(absfilename):
-            if overwrite:
+            if overwrite or damaged:
                 print("overwriting " + absfilename)
             else:
                 print("%s already exists." % absfilename)
@@ -540,14 +1117,51 @@ class SvnBackup:
             cmd[2:2] = [ "-q" ]
         if self.__deltas:
             cmd[2:2] = [ "--deltas" ]
+        if self.__jobs:
+            self.__jobs.add(self.run_dump, cmd, output, fromrev, torev)
+            return True
+        return self.run_dump(cmd, output, fromrev, torev)
+
+    def run_dump(self, cmd, output, fromrev, torev=None):
+        absfilename = output.get_absfilename()
+        realfilename = output.get_filename()
+        meter = SvnBackupMeter(output)
+        start = time.time()
         output.open()
-        r = self.exec_cmd(cmd, output, True)
+        # concurrent dumps' progress would be interleaved, so it's not shown
+        r = self.exec_cmd(cmd, meter, not self.__report)
         output.close()
         rc = r[0] == 0
+        if self.__report:
+            if not rc:
+                print(r[2])
+            self.report(realfilename, meter.bytes,
+                        os.path.getsize(absfilename), time.time() - start)
         if rc:
+            single = torev == None
+            if single:
+                torev = fromrev
+            self.__manifest.add_dump(self.__reposname, self.get_uuid(),
+                                     realfilename, fromrev, torev,
+                                     meter.bytes,
+                                     os.path.getsize(absfilename),
+                                     meter.sha1.hexdigest(), single)
             self.transfer(absfilename, realfilename)
+            indexfilename = output.get_index_filename()
+            if indexfilename:
+                self.transfer(os.path.join(self.__dumpdir, indexfilename),
+                              indexfilename)
         return rc
 
+    def report(self, filename, bytes_in, bytes_out, seconds):
+        mb_in = bytes_in / 1048576.0
+        mb_out = bytes_out / 1048576.0
+        seconds = max(seconds, 0.001)
+        print("%s: %.1f MB in, %.1f MB out in %.1f s"
+              " (%.1f MB/s in, %.1f MB/s out)"
+              % (filename, mb_in, mb_out, seconds,
+                 mb_in / seconds, mb_out / seconds))
+
     def export_single_rev(self):
         return self.create_dump(False, self.__overwrite, self.__rev_nr)
 
@@ -591,9 +1205,34 @@ class SvnBackup:
 
         return self.create_dump(False, False, last_dumped_rev + 1, headrev)
 
+    def verify(self):
+        problems = self.__manifest.verify(self.__reposname)
+        for problem in problems:
+            print("%s: %s" % (self.__reposname, problem))
+        if not problems:
+            print("%s: revisions 0-%d dumped."
+                  % (self.__reposname,
+                     self.__manifest.get_last_dumped_rev(self.__reposname)))
+        return not problems
+
+    def is_up_to_date(self):
+        # get_last_dumped_rev() also checks that the dump files are there.
+        if self.__overwrite:
+            return False
+        last_dumped_rev = self.__manifest.get_last_dumped_rev(
+                self.__reposname)
+        return last_dumped_rev != -1 \
+            and last_dumped_rev == self.get_head_rev()
+
     def execute(self):
+        if self.__verify:
+            return self.verify()
+        self.check_uuid()
         if self.__rev_nr != None:
             return self.export_single_rev()
+        elif self.is_up_to_date():
+            print("%s is up to date." % self.__reposname)
+            return True
         elif self.__relative_incremental:
             return self.export_relative_incremental()
         else:
@@ -601,7 +1240,7 @@ class SvnBackup:
 
 
 if __name__ == "__main__":
-    usage = "usage: svn-backup-dumps.py [options] repospath dumpdir"
+    usage = "usage: svn-backup-dumps.py [options] repospath... dumpdir"
     parser = OptionParser(usage=usage, version="%prog "+__version)
     if have_bz2:
         parser.add_option("-b",
@@ -645,6 +1284,23 @@ if __name__ == "__main__":
                        action="store_true",
                        dest="gzip", default=False,
                        help="compress the dump using python gzip library.")
+    if have_lzma:
+        parser.add_option("-x",
+                       action="store_true",
+                       dest="xz", default=False,
+                       help="compress the dump with xz in indexed blocks, "
+                            "using python lzma library.")
+    if have_zstd:
+        parser.add_option("--zstd",
+                       action="store_true",
+                       dest="zstd", default=False,
+                       help="compress the dump with zstd in indexed blocks, "
+                            "using python zstandard library.")
+    parser.add_option("--cat-from",
+                       action="store", type="int",
+                       dest="cat_from", default=None,
+                       help="write the dump in the -x or --zstd dumpfile "
+                            "given from this revision on to stdout.")
     parser.add_option("--bzip2-path",
                        action="store", type="string",
                        dest="bzip2_path", default=None,
@@ -661,6 +1317,20 @@ if __name__ == "__main__":
                        action="store", type="string",
                        dest="svnlook_path", default=None,
                        help="svnlook command path.")
+    parser.add_option("-j",
+                       action="store", type="int",
+                       dest="jobs", default=1,
+                       help="count of dumps to run concurrently.")
+    if have_multiprocessing:
+        parser.add_option("--compress-jobs",
+                       action="store", type="int",
+                       dest="compress_jobs", default=None,
+                       help="count of processes compressing for -z and -b "
+                            "(default: count of CPUs with -j, else none).")
+    parser.add_option("--verify",
+                       action="store_true",
+                       dest="verify", default=False,
+                       help="check the dumps recorded in the manifest.")
     parser.add_option("--help-transfer",
                        action="store_true",
                        dest="help_transfer", default=False,
@@ -676,12 +1346,57 @@ if __name__ == "__main__":
         print("    -t smb:<share>:<user>:<password>:<dest-path>")
         print("")
         sys.exit(0)
+    if options.cat_from != None:
+        if len(args) != 2:
+            print("svn-backup-dumps.py: --cat-from needs one dumpfile.")
+            sys.exit(1)
+        try:
+            cat_dump_from(args[1], options.cat_from, sys.stdout)
+        except (SvnBackupException, IOError), e:
+            sys.stderr.write("svn-backup-dumps.py: %s\n" % e)
+            sys.exit(1)
+        sys.exit(0)
     rc = False
+    jobs = None
+    compress_pool = None
+    compress_jobs = getattr(options, "compress_jobs", None)
+    block_compression = getattr(options, "xz", False) \
+        or getattr(options, "zstd", False)
     try:
-        backup = SvnBackup(options, args)
-        rc = backup.execute()
+        if options.jobs > 1 or block_compression:
+            if options.jobs > 1:
+                jobs = SvnBackupJobs(options.jobs)
+            if compress_jobs is None and have_multiprocessing:
+                compress_jobs = multiprocessing.cpu_count()
+        if compress_jobs and (options.gzip or options.bzip2
+                              or block_compression):
+            compress_pool = multiprocessing.Pool(compress_jobs)
+        # one SvnBackup for each repository, all writing to the dumpdir
+        backup_args = [ args ]
+        if len(args) > 3:
+            backup_args = [ [ args[0], repospath, args[-1] ]
+                            for repospath in args[1:-1] ]
+        manifest = None
+        if len(args) >= 3 and os.path.isdir(args[-1]):
+            manifest = SvnBackupManifest(args[-1])
+        backups = []
+        for a in backup_args:
+            backups.append(SvnBackup(options, a, jobs, compress_pool,
+                                     compress_jobs or 0, manifest))
+        rc = True
+        for backup in backups:
+            try:
+                rc = backup.execute() and rc
+            except SvnBackupException, e:
+                print("svn-backup-dumps.py: %s" % e)
+                rc = False
+        if jobs:
+            rc = jobs.run() and rc
     except SvnBackupException, e:
         print("svn-backup-dumps.py: %s" % e)
+    if compress_pool:
+        compress_pool.close()
+        compress_pool.join()
     if rc:
         print("Everything OK.")
         sys.exit(0)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# Compare how long commit-hook.py takes to gather a commit with svnlook
+# and with the Subversion Python bindings, and check both agree.
+# Nothing is published.
+#
+# usage: commit-hook-bench.py REPOS [FIRST_REV [LAST_REV]]
+#
+
+import sys
+import os
+import imp
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+hook = imp.load_source('commit_hook',
+                       os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    'commit-hook.py'))
+
+
+def timed(func, repo, revs):
+  results = {}
+  start = time.time()
+  for rev in revs:
+    results[rev] = func(repo, str(rev))
+  return time.time() - start, results
+
+
+def main(repo, first=None, last=None):
+  if not hook.USE_BINDINGS:
+    sys.stderr.write("The Subversion Python bindings are not available.\n")
+    sys.exit(1)
+
+  if last is None:
+    last = int(hook.svnlook(['youngest', '--', repo]).strip())
+  if first is None:
+    first = max(1, last - 99)
+  revs = range(first, last + 1)
+
+  svnlook_time, svnlook_results = timed(hook.svnlook_data, repo, revs)
+  repos_time, repos_results = timed(hook.repos_data, repo, revs)
+
+  for rev in revs:
+    if svnlook_results[rev] != repos_results[rev]:
+      sys.stderr.write("r%d: svnlook and bindings disagree\n" % rev)
+
+  print('%d revisions' % len(revs))
+  print('svnlook:  %8.2f ms/commit' % (svnlook_time * 1000.0 / len(revs)))
+  print('bindings: %8.2f ms/commit' % (repos_time * 1000.0 / len(revs)))
+
+
+if __name__ == '__main__':
+  if len(sys.argv) < 2 or len(sys.argv) > 4:
+    sys.stderr.write("usage: %s REPOS [FIRST_REV [LAST_REV]]\n" % sys.argv[0])
+    sys.exit(1)
+  main(sys.argv[1], *[int(arg) for arg in sys.argv[2:]])
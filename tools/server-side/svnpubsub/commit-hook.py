@@ -22,16 +22,43 @@ SVNLOOK="/usr/local/svn-install/current/bin/svnlook"
 HOST="127.0.0.1"
 PORT=2069
 
+# If set, notifications are spooled to this directory (which must be
+# writable by every hook) and published by whichever hook invocation
+# holds its lock, as newline-delimited batches over one keep-alive
+# connection.  Concurrent commits then share requests instead of each
+# opening its own, and a notification that could not be delivered is
+# retried by the next commit.  A notification that the server rejects
+# (a 4xx response) is not retried, but moved to the "bad" subdirectory;
+# the others in its batch are then sent one by one.
+SPOOL_DIR=None
+
+# Read the commit through the Subversion Python bindings in this process
+# instead of running svnlook three times.  svnlook is still used if the
+# bindings cannot be imported.
+USE_BINDINGS=True
+
 import sys
+import os
+import time
+import errno
+import fcntl
 try:
     import simplejson as json
 except ImportError:
     import json
 
+import httplib
 import urllib2
 
 import svnpubsub.util
 
+try:
+    import svn.core
+    import svn.fs
+    import svn.repos
+except ImportError:
+    USE_BINDINGS=False
+
 def svnlook(cmd, **kwargs):
     args = [SVNLOOK] + cmd
     return svnpubsub.util.check_output(args, **kwargs)
@@ -60,6 +87,66 @@ def svnlook_changed(repo, revision):
         changed[filename] = {'flags': flags}
     return changed
 
+def svnlook_data(repo, revision):
+    i = svnlook_info(repo, revision)
+    return {'repository': svnlook_uuid(repo),
+            'committer': i['author'],
+            'log': i['log'],
+            'date': i['date'],
+            'changed': svnlook_changed(repo, revision),
+            }
+
+def change_flags(change):
+    # The same three columns as 'svnlook changed'.
+    if change.change_kind in (svn.fs.path_change_add,
+                              svn.fs.path_change_replace):
+        return 'A  '
+    if change.change_kind == svn.fs.path_change_delete:
+        return 'D  '
+    if not change.text_mod and not change.prop_mod:
+        return None
+    return ((change.text_mod and 'U' or '_')
+            + (change.prop_mod and 'U' or ' ') + ' ')
+
+def repos_changed(fs_ptr, root, rev):
+    changed = {}
+    for path, change in svn.fs.paths_changed2(root).items():
+        flags = change_flags(change)
+        if flags is None:
+            continue
+        kind = change.node_kind
+        if kind not in (svn.core.svn_node_file, svn.core.svn_node_dir):
+            # Older filesystems do not record the kind of the change.
+            if change.change_kind == svn.fs.path_change_delete:
+                kind = svn.fs.check_path(svn.fs.revision_root(fs_ptr, rev - 1),
+                                         path)
+            else:
+                kind = svn.fs.check_path(root, path)
+        filename = path.lstrip('/')
+        if kind == svn.core.svn_node_dir:
+            filename += '/'
+        changed[filename] = {'flags': flags}
+    return changed
+
+def repos_data(repo, revision):
+    fs_ptr = svn.repos.fs(svn.repos.open(repo))
+    rev = int(revision)
+
+    def revprop(name):
+        return svn.fs.revision_prop(fs_ptr, rev, name) or ''
+
+    date = revprop(svn.core.SVN_PROP_REVISION_DATE)
+    if date:
+        date = svn.core.svn_time_to_human_cstring(
+                 svn.core.svn_time_from_cstring(date))
+    return {'repository': svn.fs.get_uuid(fs_ptr),
+            'committer': revprop(svn.core.SVN_PROP_REVISION_AUTHOR),
+            'log': revprop(svn.core.SVN_PROP_REVISION_LOG).strip(),
+            'date': date,
+            'changed': repos_changed(fs_ptr, svn.fs.revision_root(fs_ptr, rev),
+                                     rev),
+            }
+
 def do_put(body):
     opener = urllib2.build_opener(urllib2.HTTPHandler)
     request = urllib2.Request("http://%s:%d/commits" %(HOST, PORT), data=body)
@@ -67,22 +154,113 @@ def do_put(body):
     request.get_method = lambda: 'PUT'
     url = opener.open(request)
 
+def spool(body):
+    name = "%017.6f-%d.json" % (time.time(), os.getpid())
+    tmp = os.path.join(SPOOL_DIR, "." + name)
+    f = open(tmp, "w")
+    f.write(body)
+    f.close()
+    # Publishers only pick up complete files.
+    os.rename(tmp, os.path.join(SPOOL_DIR, name))
+
+def spooled():
+    return sorted(n for n in os.listdir(SPOOL_DIR) if n.endswith(".json"))
+
+def publish_spool():
+    lock = open(os.path.join(SPOOL_DIR, ".lock"), "w")
+    try:
+        while spooled():
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                # Another hook is publishing and will pick ours up.  If it
+                # is just finishing, it re-checks the spool after unlocking.
+                return
+            try:
+                drain_spool()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+    finally:
+        lock.close()
+
+def bad_dir():
+    return os.path.join(SPOOL_DIR, "bad")
+
+def set_aside(names):
+    try:
+        os.mkdir(bad_dir())
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    for name in names:
+        os.rename(os.path.join(SPOOL_DIR, name),
+                  os.path.join(bad_dir(), name))
+
+def put_batch(conn, bodies):
+    conn.request("PUT", "/commits", "\n".join(bodies) + "\n",
+                 {"Content-Type": "application/x-ndjson"})
+    response = conn.getresponse()
+    return response.status, response.read()
+
+def publish(conn, names, bodies, rejected):
+    """Send the spooled notifications NAMES, with the contents BODIES, and
+    remove them.  Those the server rejects are set aside and appended to
+    REJECTED; any other failure raises, leaving the rest spooled."""
+    status, result = put_batch(conn, bodies)
+    if 400 <= status < 500 and len(names) > 1:
+        # One bad notification rejects the whole batch; find it.
+        for name, body in zip(names, bodies):
+            publish(conn, [name], [body], rejected)
+        return
+    if 400 <= status < 500:
+        set_aside(names)
+        rejected.append("%s: %s %s" % (names[0], status, result))
+        return
+    if status != 200:
+        raise Exception("publishing %d notifications failed: %s %s"
+                        % (len(names), status, result))
+    for name in names:
+        os.remove(os.path.join(SPOOL_DIR, name))
+
+def drain_spool():
+    conn = httplib.HTTPConnection(HOST, PORT)
+    rejected = []
+    try:
+        while True:
+            names = spooled()
+            if not names:
+                break
+            bodies = []
+            for name in names:
+                f = open(os.path.join(SPOOL_DIR, name))
+                bodies.append(f.read())
+                f.close()
+            publish(conn, names, bodies, rejected)
+    finally:
+        conn.close()
+    if rejected:
+        raise Exception("%d notifications were rejected, moved to %s:\n%s"
+                        % (len(rejected), bad_dir(), "\n".join(rejected)))
+
 
 def main(repo, revision):
     revision = revision.lstrip('r')
-    i = svnlook_info(repo, revision)
     data = {'type': 'svn',
             'format': 1,
             'id': int(revision),
-            'changed': {},
-            'repository': svnlook_uuid(repo),
-            'committer': i['author'],
-            'log': i['log'],
-            'date': i['date'],
             }
-    data['changed'].update(svnlook_changed(repo, revision))
+    if USE_BINDINGS:
+        data.update(repos_data(repo, revision))
+    else:
+        data.update(svnlook_data(repo, revision))
     body = json.dumps(data)
-    do_put(body)
+    if SPOOL_DIR:
+        spool(body)
+        publish_spool()
+    else:
+        do_put(body)
 
 if __name__ == "__main__":
     if len(sys.argv) not in (3, 4):
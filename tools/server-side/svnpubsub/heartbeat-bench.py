@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# Compare the cost of SvnPubSub heartbeats with one timer per client
+# (the old scheme) against the single server-wide tick.
+#
+# Both run against twisted's deterministic Clock with in-memory requests,
+# so only timer bookkeeping, encoding and writing are measured.
+#
+# usage: heartbeat-bench.py [CLIENTS] [TICKS]
+#
+
+import sys
+import os
+import time
+import json
+
+from twisted.internet import task
+
+try:
+  process_time = time.process_time
+except AttributeError:
+  process_time = time.clock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from svnpubsub import server
+
+
+class FakeDeferred(object):
+  def addErrback(self, callback):
+    pass
+
+
+class FakeAddress(object):
+  port = 0
+
+
+class FakeRequest(object):
+  client = FakeAddress()
+  transport = None
+
+  def __init__(self):
+    self.written = 0
+
+  def notifyFinish(self):
+    return FakeDeferred()
+
+  def getClientIP(self):
+    return '127.0.0.1'
+
+  def setHeader(self, name, value):
+    pass
+
+  def registerProducer(self, producer, streaming):
+    pass
+
+  def write(self, data):
+    self.written += len(data)
+
+
+def per_client(clients, clock, ticks):
+  # What Client.start() used to do: every client reschedules itself and
+  # encodes its own heartbeat.
+  def heartbeat(client):
+    if client.alive:
+      client.write_heartbeat(str(json.dumps({"stillalive": time.time()})
+                                 + "\n\0"))
+      clock.callLater(server.HEARTBEAT_TIME, heartbeat, client)
+
+  for client in clients:
+    clock.callLater(server.HEARTBEAT_TIME, heartbeat, client)
+  timers = len(clock.getDelayedCalls())
+  start = time.time()
+  for i in range(ticks):
+    clock.advance(server.HEARTBEAT_TIME)
+  return timers, time.time() - start
+
+
+def shared(pubsub, clock, ticks):
+  loop = task.LoopingCall(pubsub.heartbeat)
+  loop.clock = clock
+  loop.start(server.HEARTBEAT_TIME, now=False)
+  timers = len(clock.getDelayedCalls())
+  start = time.time()
+  for i in range(ticks):
+    clock.advance(server.HEARTBEAT_TIME)
+  loop.stop()
+  return timers, time.time() - start
+
+
+def main(count, ticks):
+  server.log.msg = lambda *args, **kw: None
+  pubsub = server.SvnPubSub(server.Commit)
+  for i in range(count):
+    client = server.Client(pubsub, FakeRequest(), server.Commit.KIND,
+                           None, None)
+    pubsub.add(client)
+
+  for name, run in (('per-client', lambda c: per_client(pubsub.clients, c,
+                                                        ticks)),
+                    ('shared', lambda c: shared(pubsub, c, ticks))):
+    cpu = process_time()
+    timers, elapsed = run(task.Clock())
+    cpu = process_time() - cpu
+    print('%-10s %6d clients %6d timers  %8.2f ms/tick  %8.2f ms cpu/tick'
+          % (name, count, timers, elapsed * 1000.0 / ticks,
+             cpu * 1000.0 / ticks))
+
+
+if __name__ == '__main__':
+  count = 10000
+  ticks = 20
+  if len(sys.argv) > 1:
+    count = int(sys.argv[1])
+  if len(sys.argv) > 2:
+    ticks = int(sys.argv[2])
+  main(count, ticks)
@@ -0,0 +1,320 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# asyncio client for SvnPubSub (Python 3.6 or later)
+#
+# This is the asyncio counterpart of svnpubsub/client.py, for programs that
+# want to share one event loop between SvnPubSub streams and other I/O.
+# The callbacks have the same signatures as in svnpubsub.client:
+#
+#   client = MultiClient(urls, commit_callback, event_callback,
+#                        metadata_callback)
+#   asyncio.get_event_loop().run_until_complete(client.run_forever())
+#
+# Alternatively, iterate over the notifications of all streams:
+#
+#   async for url, notification in MultiClient(urls):
+#     if notification.KIND == 'COMMIT':
+#       ...
+#
+# The event_callback, if given, is still called in that mode.
+#
+# EVENTS
+#
+#   connected: a connection to the server has been established
+#   closed:    the connection was closed. reconnect will be attempted.
+#   error:     an error closed the connection. reconnect will be attempted.
+#   version:   the server has announced its stream format version
+#   ping:      the server has sent a keepalive
+#   stale:     no activity has been seen, so the connection will be closed
+#                 and reopened
+#
+# Reconnects back off exponentially, from RECONNECT_DELAY up to
+# MAX_RECONNECT_DELAY, and ask the server to replay the commits missed in
+# the meantime (see "RESUMING" in svnpubsub/client.py).
+#
+
+import asyncio
+import json
+import random
+import urllib.parse
+
+
+# Delay before the first reconnect attempt.  Each failed attempt doubles
+# it, up to MAX_RECONNECT_DELAY.
+RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 300.0
+
+# If we don't see anything from the server for this amount time, then we
+# will drop and reconnect.
+STALE_DELAY = 60.0
+
+# How much to ask for per socket read.
+READ_SIZE = 65536
+
+
+class SvnpubsubClientException(Exception):
+  pass
+
+
+class Notification(object):
+  def __init__(self, data):
+    self.__dict__.update(data)
+
+class Commit(Notification):
+  KIND = 'COMMIT'
+
+class Metadata(Notification):
+  KIND = 'METADATA'
+
+
+class RecordParser(object):
+  """Incremental parser for the stream of NUL-terminated JSON records.
+
+  Incoming data is appended to a single buffer.  Bytes already scanned for
+  a terminator are not scanned again, and consumed records are trimmed
+  from the buffer once per feed() rather than once per record.
+  """
+
+  EXPECTED_VERSION = 1
+
+  def __init__(self):
+    self.buffer = bytearray()
+    self.scanned = 0
+
+  def feed(self, data):
+    """Add DATA and return the notifications it completes, as a list of
+    (kind, payload) pairs.  KIND is one of 'svnpubsub', 'commit',
+    'metadata' or 'stillalive'; unknown records are skipped."""
+    buf = self.buffer
+    buf += data
+    records = []
+    start = 0
+    while True:
+      end = buf.find(b'\0', self.scanned)
+      if end < 0:
+        break
+      self.scanned = end + 1
+      # Records are followed by a newline; json.loads() doesn't mind it.
+      if end > start:
+        obj = json.loads(buf[start:end].decode('utf-8'))
+        records.extend(self._classify(obj))
+      start = end + 1
+    if start:
+      del buf[:start]
+      self.scanned -= start
+    return records
+
+  def _classify(self, obj):
+    if 'svnpubsub' in obj:
+      actual_version = obj['svnpubsub'].get('version')
+      if actual_version != self.EXPECTED_VERSION:
+        raise SvnpubsubClientException(
+          "Unknown svnpubsub format: %r != %d"
+          % (actual_version, self.EXPECTED_VERSION))
+      return [('svnpubsub', actual_version)]
+    elif 'commit' in obj:
+      return [('commit', Commit(obj['commit']))]
+    elif 'metadata' in obj:
+      return [('metadata', Metadata(obj['metadata']))]
+    elif 'stillalive' in obj:
+      return [('stillalive', obj['stillalive'])]
+    return []
+
+
+class Client(object):
+  """A single, self-reconnecting SvnPubSub stream.
+
+  Iterating over a Client yields Commit and Metadata notifications.  The
+  callbacks take the same arguments as for svnpubsub.client.Client.
+  """
+
+  def __init__(self, url, commit_callback=None, event_callback=None,
+               metadata_callback=None):
+    self.url = url
+    parsed_url = urllib.parse.urlsplit(url)
+    if parsed_url.scheme != 'http':
+      raise ValueError("URL scheme must be http: '%s'" % url)
+    self.host = parsed_url.hostname
+    self.port = parsed_url.port or 80
+    self.path = parsed_url.path or '/'
+    self.query = parsed_url.query
+
+    self.commit_callback = commit_callback
+    self.event_callback = event_callback
+    self.metadata_callback = metadata_callback
+
+    # repository UUID -> last commit id delivered
+    self.last_seen = { }
+
+  def _event(self, event_name, event_arg):
+    if self.event_callback:
+      self.event_callback(event_name, event_arg)
+
+  def _since(self):
+    if not self.last_seen:
+      return None
+    return min(self.last_seen.values())
+
+  def _is_new(self, commit):
+    try:
+      rev = int(commit.id)
+    except (AttributeError, TypeError, ValueError):
+      return True
+    repository = getattr(commit, 'repository', None)
+    last = self.last_seen.get(repository)
+    if last is not None and rev <= last:
+      # Replayed after a reconnect, but already delivered.
+      return False
+    self.last_seen[repository] = rev
+    return True
+
+  def _request(self):
+    query = self.query
+    since = self._since()
+    if since is not None:
+      if query:
+        query += '&'
+      query += 'since=%d' % since
+    resource = self.path
+    if query:
+      resource += '?' + query
+    return ('GET %s HTTP/1.0\r\nHost: %s\r\n\r\n'
+            % (resource, self.host)).encode('ascii')
+
+  async def _stream(self):
+    reader, writer = await asyncio.open_connection(self.host, self.port)
+
+    # A timer rather than asyncio.wait_for() around every read: it is
+    # cheaper, and wait_for() can swallow a cancellation on Python < 3.12.
+    loop = asyncio.get_event_loop()
+    stale = [ ]
+    def went_stale():
+      stale.append(True)
+      writer.transport.abort()
+    timer = loop.call_later(STALE_DELAY, went_stale)
+
+    try:
+      self._event('connected', None)
+      writer.write(self._request())
+      headers = await reader.readuntil(b'\r\n\r\n')
+      status = headers.split(b'\r\n', 1)[0].split()
+      if len(status) < 2 or status[1] != b'200':
+        raise SvnpubsubClientException('Unexpected response: %r'
+                                       % b' '.join(status))
+
+      parser = RecordParser()
+      while True:
+        data = await reader.read(READ_SIZE)
+        timer.cancel()
+        if not data:
+          self._event(stale and 'stale' or 'closed', None)
+          return
+        timer = loop.call_later(STALE_DELAY, went_stale)
+        for kind, payload in parser.feed(data):
+          yield kind, payload
+    finally:
+      timer.cancel()
+      writer.close()
+
+  async def notifications(self):
+    """Yield notifications forever, reconnecting as needed."""
+    delay = RECONNECT_DELAY
+    while True:
+      try:
+        async for kind, payload in self._stream():
+          # Only a working stream resets the backoff.
+          delay = RECONNECT_DELAY
+          if kind == 'svnpubsub':
+            self._event('version', payload)
+          elif kind == 'stillalive':
+            self._event('ping', payload)
+          elif kind == 'commit':
+            if self._is_new(payload):
+              yield payload
+          else:
+            yield payload
+      except asyncio.CancelledError:
+        raise
+      except Exception as e:
+        self._event('error', e)
+
+      # Jitter keeps many clients from reconnecting in lockstep.
+      await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+      delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+  def __aiter__(self):
+    return self.notifications()
+
+  async def run_forever(self):
+    async for notification in self:
+      if notification.KIND == Commit.KIND:
+        if self.commit_callback:
+          self.commit_callback(notification)
+      elif self.metadata_callback:
+        self.metadata_callback(notification)
+
+
+class MultiClient(object):
+  """Several Client streams sharing one event loop.
+
+  Callbacks take the URL as their first argument, as for
+  svnpubsub.client.MultiClient.  Iterating yields (url, notification).
+  """
+
+  def __init__(self, urls, commit_callback=None, event_callback=None,
+               metadata_callback=None):
+    self.commit_callback = commit_callback
+    self.event_callback = event_callback
+    self.metadata_callback = metadata_callback
+
+    self.clients = [ ]
+    for url in urls:
+      self.clients.append(Client(url, event_callback=self._bind_event(url)))
+
+  def _bind_event(self, url):
+    if not self.event_callback:
+      return None
+    return lambda event_name, event_arg: \
+        self.event_callback(url, event_name, event_arg)
+
+  async def _pump(self, client, queue):
+    async for notification in client:
+      await queue.put((client.url, notification))
+
+  async def notifications(self):
+    queue = asyncio.Queue(maxsize=len(self.clients) * 16)
+    tasks = [asyncio.ensure_future(self._pump(client, queue))
+             for client in self.clients]
+    try:
+      while True:
+        yield await queue.get()
+    finally:
+      for task in tasks:
+        task.cancel()
+
+  def __aiter__(self):
+    return self.notifications()
+
+  async def run_forever(self):
+    async for url, notification in self:
+      if notification.KIND == Commit.KIND:
+        if self.commit_callback:
+          self.commit_callback(url, notification)
+      elif self.metadata_callback:
+        self.metadata_callback(url, notification)
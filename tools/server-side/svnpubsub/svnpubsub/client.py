@@ -32,6 +32,13 @@
 #   stale:     no activity has been seen, so the connection will be closed
 #                 and reopened
 #
+# RESUMING
+#
+#   MultiClient remembers the last commit id (revision) it has seen for
+#   each repository of each URL.  When it reconnects, it asks the server
+#   to replay the commits it missed ("since=N") and drops any replayed
+#   commit it had already delivered.
+#
 
 import asyncore
 import asynchat
@@ -63,7 +70,7 @@ class SvnpubsubClientException(Exception):
 class Client(asynchat.async_chat):
 
   def __init__(self, url, commit_callback, event_callback,
-               metadata_callback = None):
+               metadata_callback = None, since = None):
     asynchat.async_chat.__init__(self)
 
     self.last_activity = time.time()
@@ -76,8 +83,13 @@ class Client(asynchat.async_chat):
     host = parsed_url.hostname
     port = parsed_url.port
     resource = parsed_url.path
-    if parsed_url.query:
-      resource += "?%s" % parsed_url.query
+    query = parsed_url.query
+    if since is not None:
+      if query:
+        query += "&"
+      query += "since=%d" % since
+    if query:
+      resource += "?%s" % query
     if parsed_url.fragment:
       resource += "#%s" % parsed_url.fragment
 
@@ -173,6 +185,9 @@ class MultiClient(object):
     self.event_callback = event_callback
     self.metadata_callback = metadata_callback
 
+    # URL -> { repository UUID -> last commit id delivered }
+    self.last_seen = { }
+
     # No target time, as no work to do
     self.target_time = 0
     self.work_items = [ ]
@@ -198,18 +213,44 @@ class MultiClient(object):
     if not self.target_time:
       self.target_time = time.time() + RECONNECT_DELAY
 
+  def _commit(self, url, commit):
+    seen = self.last_seen.setdefault(url, { })
+    try:
+      rev = int(commit.id)
+    except (AttributeError, TypeError, ValueError):
+      rev = None
+    repository = getattr(commit, 'repository', None)
+    if rev is not None:
+      last = seen.get(repository)
+      if last is not None and rev <= last:
+        # Already delivered before the reconnect.
+        return
+      seen[repository] = rev
+
+    self.commit_callback(url, commit)
+
+  def _since(self, url):
+    # The server applies a single revision to every repository the URL
+    # covers, so ask for the oldest one and weed out the rest locally.
+    seen = self.last_seen.get(url)
+    if not seen:
+      return None
+    return min(seen.values())
+
   def _add_channel(self, url):
     # Simply instantiating the client will install it into the global map
     # for processing in the main event loop.
     if self.metadata_callback:
       Client(url,
-             functools.partial(self.commit_callback, url),
+             functools.partial(self._commit, url),
              functools.partial(self._reconnect, url),
-             functools.partial(self.metadata_callback, url))
+             functools.partial(self.metadata_callback, url),
+             since=self._since(url))
     else:
       Client(url,
-             functools.partial(self.commit_callback, url),
-             functools.partial(self._reconnect, url))
+             functools.partial(self._commit, url),
+             functools.partial(self._reconnect, url),
+             since=self._since(url))
 
   def _check_stale(self):
     now = time.time()
@@ -54,6 +54,36 @@
 # Example Pub clients:
 #   curl -T revinfo.json -i http://127.0.0.1:2069/commits
 #
+#   Several notifications can be published with one request by sending
+#   them as newline-delimited JSON, one notification per line.  They are
+#   all validated first, and then sent to subscribers in order:
+#   curl -T revinfo.ndjson -H 'Content-Type: application/x-ndjson' \
+#        -i http://127.0.0.1:2069/commits
+#
+# Resuming after a disconnect:
+#   curl -sN 'http://127.0.0.1:2069/commits/svn/13f79535-47bb-0310-9956-ffa450edef68?since=1234'
+#
+#   The server remembers the last REPLAY_SIZE notifications of each
+#   repository.  A subscriber passing "since=N" (or a "Last-Event-ID: N"
+#   header) first receives every remembered notification matching its
+#   URL whose id (revision) is greater than N, in publication order, and
+#   then the live stream.  When started with a journal file (JOURNAL in
+#   svnpubsub.tac, or --journal), the remembered notifications also
+#   survive a server restart.
+#
+# Server statistics (JSON):
+#   curl -s http://127.0.0.1:2069/stats
+#
+# Flow control:
+#   Every subscriber is registered as a streaming producer on its
+#   connection.  When the transport's send buffer fills up, notifications
+#   for that subscriber are held in a queue of at most QUEUE_HIGH_WATER
+#   frames.  Heartbeats are never queued (a pending notification is
+#   proof enough of life).  Once the queue is full, QUEUE_POLICY decides
+#   whether the oldest queued frame is dropped ('drop') or the subscriber
+#   is disconnected ('evict').  Both can be set in svnpubsub.tac, or with
+#   --high-water and --queue-policy.
+#
 # TODO:
 #   - Add Real access controls (not just 127.0.0.1)
 #   - Document PUT format
@@ -67,14 +97,20 @@ try:
 except ImportError:
     import json
 
+import os
 import sys
+import optparse
+import collections
 
 import twisted
 from twisted.internet import reactor
 from twisted.internet import defer
+from twisted.internet import task
 from twisted.web import server
 from twisted.web import resource
+from twisted.internet.interfaces import IPushProducer
 from twisted.python import log
+from zope.interface import implementer
 
 import time
 
@@ -130,8 +166,128 @@ class Metadata(Notification):
             self.revprop['name'])
 
 
+class ReplayLog(object):
+    """Bounded per-repository memory of recently published notifications.
+
+    Each (kind, repository) pair keeps its last SIZE frames.  If PATH is
+    given, entries are also appended to that journal file, which is read
+    back on startup and rewritten once it holds twice as many entries as
+    the rings do.
+    """
+
+    def __init__(self, size, path=None):
+        self.size = size
+        self.path = path
+        self.rings = {}
+        self.seq = 0
+        self.journal = None
+        self.journal_len = 0
+        if path:
+            self._load()
+            self._rewrite()
+
+    def _ring(self, kind, repository):
+        key = (kind, repository)
+        ring = self.rings.get(key)
+        if ring is None:
+            ring = self.rings[key] = collections.deque(maxlen=self.size)
+        return ring
+
+    def _remember(self, kind, type, repository, id, data):
+        try:
+            rev = int(id)
+        except (TypeError, ValueError):
+            # Cannot be compared against "since", so never replayed.
+            return
+        self.seq += 1
+        self._ring(kind, repository).append((self.seq, rev, type, data))
+
+    def _load(self):
+        try:
+            f = open(self.path)
+        except IOError:
+            return
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Most likely a torn write at the end of the journal.
+                continue
+            self._remember(entry['kind'], entry['type'], entry['repository'],
+                           entry['id'], str(entry['data']))
+        f.close()
+
+    def _rewrite(self):
+        if self.journal:
+            self.journal.close()
+        tmp = self.path + '.tmp'
+        f = open(tmp, 'w')
+        entries = []
+        for (kind, repository), ring in self.rings.items():
+            for seq, rev, type, data in ring:
+                entries.append((seq, kind, type, repository, rev, data))
+        # Keep publication order across repositories.
+        entries.sort()
+        for seq, kind, type, repository, rev, data in entries:
+            f.write(json.dumps({'kind': kind, 'type': type,
+                                'repository': repository,
+                                'id': rev, 'data': data}) + "\n")
+        f.close()
+        os.rename(tmp, self.path)
+        self.journal = open(self.path, 'a')
+        self.journal_len = len(entries)
+
+    def append(self, notification, data):
+        self._remember(notification.KIND, notification.type,
+                       notification.repository, notification.id, data)
+        if self.journal:
+            self.journal.write(json.dumps({'kind': notification.KIND,
+                                           'type': notification.type,
+                                           'repository': notification.repository,
+                                           'id': notification.id,
+                                           'data': data}) + "\n")
+            self.journal.flush()
+            self.journal_len += 1
+            if self.journal_len > 2 * sum(len(r) for r in self.rings.values()):
+                self._rewrite()
+
+    def since(self, kind, type, repository, rev):
+        """Return the remembered frames matching the subscription filter
+        (None being a wildcard) with an id greater than REV, oldest first.
+        """
+        entries = []
+        for (k, r), ring in self.rings.items():
+            if k != kind or (repository and r != repository):
+                continue
+            for entry in ring:
+                if entry[1] > rev and (not type or entry[2] == type):
+                    entries.append(entry)
+        entries.sort()
+        return [entry[3] + "\n\0" for entry in entries]
+
+
 HEARTBEAT_TIME = 15
 
+# Content type of a PUT carrying newline-delimited notifications.
+BATCH_CONTENT_TYPE = 'application/x-ndjson'
+
+# Number of notifications per repository kept for replay to subscribers
+# that reconnect with "since".
+REPLAY_SIZE = 100
+
+# File the replay log is journaled to, so that it survives a restart, or
+# None to keep it in memory only.
+JOURNAL = None
+
+# Maximum number of frames queued for a subscriber that is not keeping up.
+QUEUE_HIGH_WATER = 1000
+
+# What to do with a subscriber whose queue is full: 'drop' discards its
+# oldest queued frame, 'evict' closes the connection.
+QUEUE_POLICY = 'evict'
+QUEUE_POLICIES = ('drop', 'evict')
+
+@implementer(IPushProducer)
 class Client(object):
     def __init__(self, pubsub, r, kind, type, repository):
         self.pubsub = pubsub
@@ -141,6 +297,8 @@ class Client(object):
         self.type = type
         self.repository = repository
         self.alive = True
+        self.paused = False
+        self.queue = collections.deque()
         log.msg("OPEN: %s:%d (%d clients online)"% (r.getClientIP(), r.client.port, pubsub.cc()+1))
 
     def finished(self, reason):
@@ -151,6 +309,9 @@ class Client(object):
         except ValueError:
             pass
 
+    def route_key(self):
+        return (self.kind, self.type, self.repository)
+
     def interested_in(self, notification):
         if self.kind != notification.KIND:
             return False
@@ -167,17 +328,63 @@ class Client(object):
         self.write(data)
 
     def start(self):
+        self.r.registerProducer(self, True)
         self.write_start()
-        reactor.callLater(HEARTBEAT_TIME, self.heartbeat, None)
-
-    def heartbeat(self, args):
-        if self.alive:
-            self.write_heartbeat()
-            reactor.callLater(HEARTBEAT_TIME, self.heartbeat, None)
 
     def write_data(self, data):
         self.write(data + "\n\0")
 
+    def write_frame(self, frame):
+        # FRAME is already terminated and converted to str by the caller,
+        # so it can be shared by every subscriber of a notification.
+        if not self.alive:
+            return
+        if not self.paused:
+            self.r.write(frame)
+            self.pubsub.count('frames_sent')
+            return
+
+        if len(self.queue) >= self.pubsub.high_water:
+            if self.pubsub.queue_policy == 'drop':
+                self.queue.popleft()
+                self.pubsub.count('frames_dropped')
+            else:
+                self.evict()
+                return
+        self.queue.append(frame)
+        self.pubsub.count('frames_queued')
+
+    def evict(self):
+        log.msg("EVICT: %s:%d (%d frames queued)"
+                % (self.r.getClientIP(), self.r.client.port, len(self.queue)))
+        self.pubsub.count('clients_evicted')
+        self.alive = False
+        self.queue.clear()
+        # The peer is not reading, so don't wait for the buffer to drain.
+        transport = self.r.transport
+        if hasattr(transport, 'abortConnection'):
+            transport.abortConnection()
+        else:
+            transport.loseConnection()
+
+    # IPushProducer: called by the transport as its send buffer fills up
+    # and drains.
+    def pauseProducing(self):
+        if not self.paused:
+            self.paused = True
+            self.pubsub.count('pauses')
+
+    def resumeProducing(self):
+        self.paused = False
+        # Writing may pause us again, in which case the rest stays queued.
+        while self.queue and not self.paused and self.alive:
+            self.r.write(self.queue.popleft())
+            self.pubsub.count('frames_sent')
+
+    def stopProducing(self):
+        self.alive = False
+        self.queue.clear()
+
     """ "Data must not be unicode" is what the interfaces.ITransport says... grr. """
     def write(self, input):
         self.r.write(str(input))
@@ -187,26 +394,108 @@ class Client(object):
         self.r.setHeader('content-type', 'application/vnd.apache.vc-notify+json')
         self.write('{"svnpubsub": {"version": 1}}\n\0')
 
-    def write_heartbeat(self):
-        self.write(json.dumps({"stillalive": time.time()}) + "\n\0")
+    def write_heartbeat(self, frame):
+        if self.paused:
+            self.pubsub.count('heartbeats_coalesced')
+            return
+        self.r.write(frame)
 
 
 class SvnPubSub(resource.Resource):
     isLeaf = True
     clients = []
 
+    # Subscribers bucketed by their (kind, type, repository) filter, where
+    # None stands in for a wildcard.  A notification only has to look at
+    # the four buckets that can possibly match it.
+    routes = {}
+
+    # Counters reported by the /stats resource.
+    counters = collections.defaultdict(int)
+
+    high_water = QUEUE_HIGH_WATER
+    queue_policy = QUEUE_POLICY
+
     __notification_uri_map = {'commits': Commit.KIND,
                               'metadata': Metadata.KIND}
 
-    def __init__(self, notification_class):
+    def __init__(self, notification_class, high_water=None, queue_policy=None,
+                 replay=None):
         resource.Resource.__init__(self)
         self.__notification_class = notification_class
+        if replay is None:
+            replay = ReplayLog(REPLAY_SIZE)
+        self.replay = replay
+        if high_water is not None:
+            self.high_water = high_water
+        if queue_policy is not None:
+            if queue_policy not in QUEUE_POLICIES:
+                raise ValueError('Invalid Queue Policy: %s' % queue_policy)
+            self.queue_policy = queue_policy
 
     def cc(self):
         return len(self.clients)
 
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def stats(self):
+        queued = [len(c.queue) for c in self.clients]
+        obj = {'clients': self.cc(),
+               'paused': len([c for c in self.clients if c.paused]),
+               'queued': sum(queued),
+               'max_queued': max(queued or [0]),
+               'high_water': self.high_water,
+               'queue_policy': self.queue_policy,
+               }
+        obj.update(self.counters)
+        return obj
+
+    def add(self, c):
+        self.clients.append(c)
+        self.routes.setdefault(c.route_key(), []).append(c)
+
     def remove(self, c):
         self.clients.remove(c)
+        key = c.route_key()
+        bucket = self.routes.get(key)
+        if bucket is not None:
+            bucket.remove(c)
+            if not bucket:
+                del self.routes[key]
+
+    def heartbeat(self):
+        # One tick for the whole server: the frame is encoded once, and
+        # clients that died without us hearing about it are reaped here.
+        frame = str(json.dumps({"stillalive": time.time()}) + "\n\0")
+        for client in list(self.clients):
+            if not client.alive:
+                self.remove(client)
+                self.count('clients_reaped')
+                continue
+            try:
+                client.write_heartbeat(frame)
+            except Exception:
+                # An exception would stop the LoopingCall, and with it the
+                # heartbeat of every other client.
+                log.err(None, "HEARTBEAT: dropping %s:%d"
+                        % (client.r.getClientIP(), client.r.client.port))
+                client.alive = False
+                self.remove(client)
+                self.count('clients_dropped')
+        self.count('heartbeats')
+
+    def subscribers(self, notification):
+        kind = notification.KIND
+        for key in ((kind, None, None),
+                    (kind, notification.type, None),
+                    (kind, None, notification.repository),
+                    (kind, notification.type, notification.repository)):
+            bucket = self.routes.get(key)
+            if bucket:
+                # Copy, since a write may end up closing the client.
+                for client in list(bucket):
+                    yield client
 
     def render_GET(self, request):
         log.msg("REQUEST: %s"  % (request.uri))
@@ -215,7 +504,7 @@ class SvnPubSub(resource.Resource):
         repository = None
         type = None
 
-        uri = request.uri.split('/')
+        uri = request.path.split('/')
         uri_len = len(uri)
         if uri_len < 2 or uri_len > 4:
             request.setResponseCode(400)
@@ -232,25 +521,43 @@ class SvnPubSub(resource.Resource):
         if uri_len == 4:
           repository = uri[3]
 
-        # Convert wild card to None.
-        if type == '*':
+        # Convert wild card (or an empty segment, as in "/commits/") to None.
+        if type in ('*', ''):
           type = None
-        if repository == '*':
+        if repository in ('*', ''):
           repository = None
 
+        since = request.args.get('since', [None])[0]
+        if since is None:
+          since = request.getHeader('last-event-id')
+        if since is not None:
+          try:
+            since = int(since)
+          except ValueError:
+            request.setResponseCode(400)
+            return "Invalid since value\n"
+
         c = Client(self, request, kind, type, repository)
-        self.clients.append(c)
+        self.add(c)
         c.start()
+        if since is not None:
+          frames = self.replay.since(kind, type, repository, since)
+          log.msg("REPLAY: %d notifications since %d" % (len(frames), since))
+          self.count('frames_replayed', len(frames))
+          for frame in frames:
+            c.write_frame(frame)
         return twisted.web.server.NOT_DONE_YET
 
     def notifyAll(self, notification):
-        data = notification.render()
+        data = str(notification.render())
+        frame = data + "\n\0"
+        self.replay.append(notification, data)
 
         log.msg("%s: %s (%d clients)"
                 % (notification.KIND, notification.render_log(), self.cc()))
-        for client in self.clients:
-            if client.interested_in(notification):
-                client.write_data(data)
+        self.count('notifications')
+        for client in self.subscribers(notification):
+            client.write_frame(frame)
 
     def render_PUT(self, request):
         request.setHeader('content-type', 'text/plain')
@@ -261,6 +568,9 @@ class SvnPubSub(resource.Resource):
         input = request.content.read()
         #import pdb;pdb.set_trace()
         #print "input: %s" % (input)
+        content_type = request.getHeader('content-type') or ''
+        if content_type.split(';')[0].strip() == BATCH_CONTENT_TYPE:
+            return self.render_batch(request, input)
         try:
             data = json.loads(input)
             notification = self.__notification_class(data)
@@ -272,18 +582,79 @@ class SvnPubSub(resource.Resource):
         self.notifyAll(notification)
         return "Ok"
 
+    def render_batch(self, request, input):
+        notifications = []
+        for lineno, line in enumerate(input.split("\n")):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+                notifications.append(self.__notification_class(data))
+            except ValueError as e:
+                # Publish nothing, so that the sender can simply retry.
+                request.setResponseCode(400)
+                errstr = "line %d: %s" % (lineno + 1, e)
+                log.msg("BATCH: failed due to: %s" % errstr)
+                return errstr
+        log.msg("BATCH: %d notifications" % len(notifications))
+        self.count('batches')
+        for notification in notifications:
+            self.notifyAll(notification)
+        return "Ok"
+
 
-def svnpubsub_server():
+class Stats(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, pubsub):
+        resource.Resource.__init__(self)
+        self.pubsub = pubsub
+
+    def render_GET(self, request):
+        request.setHeader('content-type', 'application/json')
+        return json.dumps({'stats': self.pubsub.stats()}) + "\n"
+
+
+def svnpubsub_server(high_water=None, queue_policy=None, journal=None):
+    """Return the site.  Settings left as None take their values from
+    QUEUE_HIGH_WATER, QUEUE_POLICY and JOURNAL."""
+    if high_water is None:
+        high_water = QUEUE_HIGH_WATER
+    if queue_policy is None:
+        queue_policy = QUEUE_POLICY
+    if journal is None:
+        journal = JOURNAL
     root = resource.Resource()
-    c = SvnPubSub(Commit)
-    m = SvnPubSub(Metadata)
+    replay = ReplayLog(REPLAY_SIZE, journal)
+    c = SvnPubSub(Commit, high_water, queue_policy, replay)
+    m = SvnPubSub(Metadata, high_water, queue_policy, replay)
     root.putChild('commits', c)
     root.putChild('metadata', m)
+    # Clients and counters are shared, so either resource can report them
+    # and a single heartbeat covers both.
+    root.putChild('stats', Stats(c))
+    task.LoopingCall(c.heartbeat).start(HEARTBEAT_TIME, now=False)
     return server.Site(root)
 
 if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option('--journal', default=JOURNAL,
+                      help='file to journal the replay log to')
+    parser.add_option('--high-water', type='int', default=QUEUE_HIGH_WATER,
+                      help='frames queued for a subscriber that is not '
+                           'keeping up [default: %default]')
+    parser.add_option('--queue-policy', type='choice',
+                      choices=QUEUE_POLICIES, default=QUEUE_POLICY,
+                      help="what to do when a subscriber's queue is full: "
+                           "'drop' or 'evict' [default: %default]")
+    options, extra = parser.parse_args()
+    if extra:
+        parser.error('unexpected arguments: %s' % ' '.join(extra))
+
     log.startLogging(sys.stdout)
     # Port 2069 "HTTP Event Port", whatever, sounds good to me
-    reactor.listenTCP(2069, svnpubsub_server())
+    reactor.listenTCP(2069, svnpubsub_server(options.high_water,
+                                             options.queue_policy,
+                                             options.journal))
     reactor.run()
 
@@ -62,6 +62,7 @@ except ImportError:
   import queue as Queue
 import optparse
 import functools
+import collections
 try:
   import urlparse
 except ImportError:
@@ -71,6 +72,17 @@ import daemonize
 import svnpubsub.client
 import svnpubsub.util
 
+# With the Subversion Python bindings, working copies are updated
+# in-process instead of by running the svn binary.
+try:
+    import svn.core
+    import svn.client
+    import svn.ra
+    import svn.wc
+    have_bindings = True
+except ImportError:
+    have_bindings = False
+
 assert hasattr(subprocess, 'check_call')
 def check_call(*args, **kwds):
     """Wrapper around subprocess.check_call() that logs stderr upon failure,
@@ -122,6 +134,98 @@ except (ImportError, AttributeError):
         # This will read the entire directory list to memory.
         return not os.listdir(path)
 
+class InProcessSvn(object):
+    """Client state for updating working copies through the bindings.
+
+    One client context, auth baton and set of RA sessions is reused for
+    all updates done by a worker thread.  The options match the svn
+    command lines used by BackgroundWorker."""
+
+    def __init__(self, env):
+        config_dir = None
+        if 'HOME' in env:
+            config_dir = os.path.join(env['HOME'], '.subversion')
+
+        self.ctx = svn.client.svn_client_create_context()
+        self.ctx.config = svn.core.svn_config_get_config(config_dir)
+        # --config-option config:miscellany:use-commit-times=on
+        svn.core.svn_config_set_bool(
+          self.ctx.config[svn.core.SVN_CONFIG_CATEGORY_CONFIG],
+          svn.core.SVN_CONFIG_SECTION_MISCELLANY,
+          svn.core.SVN_CONFIG_OPTION_USE_COMMIT_TIMES, True)
+
+        providers = [
+          svn.client.svn_client_get_simple_provider(),
+          svn.client.svn_client_get_username_provider(),
+          svn.client.svn_client_get_ssl_server_trust_file_provider(),
+          svn.core.svn_auth_get_ssl_server_trust_prompt_provider(
+            self._trust_server_cert),
+          ]
+        self.ctx.auth_baton = svn.core.svn_auth_open(providers)
+        if config_dir:
+            svn.core.svn_auth_set_parameter(self.ctx.auth_baton,
+                                            svn.core.SVN_AUTH_PARAM_CONFIG_DIR,
+                                            config_dir)
+
+        # URL -> RA session, for looking up HEAD
+        self.sessions = { }
+
+    def _trust_server_cert(self, realm, failures, cert_info, may_save, pool):
+        # Like --trust-server-cert: accept an unknown CA, but nothing else.
+        if failures & ~svn.core.SVN_AUTH_SSL_UNKNOWNCA:
+            return None
+        cred = svn.core.svn_auth_cred_ssl_server_trust_t()
+        cred.accepted_failures = failures
+        cred.may_save = False
+        return cred
+
+    def head(self, url):
+        "Return the youngest revision of the repository at URL."
+        session = self.sessions.get(url)
+        if session is not None:
+            try:
+                return svn.ra.get_latest_revnum(session)
+            except svn.core.SubversionException:
+                # The connection may have gone away; retry once with a
+                # new session.
+                logging.info('reopening RA session: %s', url)
+                del self.sessions[url]
+        session = svn.client.open_ra_session(url, self.ctx)
+        revnum = svn.ra.get_latest_revnum(session)
+        self.sessions[url] = session
+        return revnum
+
+    def cleanup_if_locked(self, path):
+        "Clean up PATH if it is locked. Return whether that was needed."
+        locked_here, locked = svn.wc.locked2(self.ctx.wc_ctx,
+                                             os.path.abspath(path))
+        if not (locked_here or locked):
+            return False
+        svn.client.cleanup(path, self.ctx)
+        return True
+
+    def switch(self, path, url, revision):
+        "Switch PATH to URL@REVISION and return the revision it is now at."
+        rev = svn.core.svn_opt_revision_t()
+        rev.kind = svn.core.svn_opt_revision_number
+        rev.value.number = revision
+        try:
+            return self._switch(path, url, rev)
+        except svn.core.SubversionException as e:
+            if e.apr_err not in (svn.core.SVN_ERR_WC_CLEANUP_REQUIRED,
+                                 svn.core.SVN_ERR_WC_LOCKED):
+                raise
+            logging.info('cleanup required: %s', path)
+            svn.client.cleanup(path, self.ctx)
+            return self._switch(path, url, rev)
+
+    def _switch(self, path, url, rev):
+        # --ignore-externals, default depth, not ignoring ancestry.
+        return svn.client.switch3(path, url, rev, rev,
+                                  svn.core.svn_depth_unknown, False,
+                                  True, False, False, self.ctx)
+
+
 class WorkingCopy(object):
     def __init__(self, bdec, path, url):
         self.path = path
@@ -185,7 +289,10 @@ class BigDoEverythingClasss(object):
         self.tracking = config.get_track()
         self.hook = config.get_optional_value('hook')
         self.streams = config.get_value('streams').split()
-        self.worker = BackgroundWorker(self.svnbin, self.env, self.hook)
+        self.worker = WorkerPool(self.svnbin, self.env, self.hook,
+                                 int(config.get_optional_value('workers', 1)),
+                                 config.get_optional_value('bindings', 'no')
+                                   .lower() in ('yes', 'true', 'on', '1'))
         self.watch = [ ]
 
     def start(self):
@@ -238,32 +345,136 @@ OP_BOOT = 'boot'
 OP_UPDATE = 'update'
 OP_CLEANUP = 'cleanup'
 
-class BackgroundWorker(threading.Thread):
-    def __init__(self, svnbin, env, hook):
-        threading.Thread.__init__(self)
+class WorkerPool(object):
+    """Run operations on working copies with up to WORKERS threads.
 
-        # The main thread/process should not wait for this thread to exit.
-        ### compat with Python 2.5
-        self.setDaemon(True)
+    Operations on one working copy run one at a time and in the order they
+    were added; different working copies are handled in parallel.
 
+    Updates always go to the latest revision, so an update requested while
+    one is already pending (not yet started) for the same working copy is
+    absorbed by it."""
+
+    def __init__(self, svnbin, env, hook, workers=1, use_bindings=False):
         self.svnbin = svnbin
         self.env = env
         self.hook = hook
-        self.q = Queue.Queue()
+        self.workers = max(1, workers)
+        self.use_bindings = use_bindings and have_bindings
+
+        self.lock = threading.Lock()
+        # WorkingCopy -> deque of operations not yet started
+        self.pending = { }
+        # Working copies with pending operations, waiting for a worker.
+        # Each is in here at most once, and never while it is busy.
+        self.ready = Queue.Queue()
+        self.queued = set()
+        self.busy = set()
+
+        # WorkingCopy -> requests absorbed by its pending update
+        self.collapsed = { }
+        self.total_collapsed = 0
 
         self.has_started = False
 
+    def add_work(self, operation, wc):
+        # Start the threads when work first arrives. Thread-start needs to
+        # be delayed in case the process forks itself to become a daemon.
+        if not self.has_started:
+            for i in range(self.workers):
+                BackgroundWorker(self).start()
+            self.has_started = True
+
+        self.lock.acquire()
+        try:
+            ops = self.pending.setdefault(wc, collections.deque())
+            if operation == OP_UPDATE and (OP_UPDATE in ops or OP_BOOT in ops):
+                self.collapsed[wc] = self.collapsed.get(wc, 0) + 1
+                self.total_collapsed += 1
+                return
+            ops.append(operation)
+            if wc not in self.busy and wc not in self.queued:
+                self.queued.add(wc)
+                self.ready.put(wc)
+        finally:
+            self.lock.release()
+
+    def next_work(self):
+        "Block until a working copy is available, claim it and return work."
+        wc = self.ready.get()
+        self.lock.acquire()
+        try:
+            self.queued.remove(wc)
+            self.busy.add(wc)
+            operation = self.pending[wc].popleft()
+            collapsed = 0
+            if operation in (OP_UPDATE, OP_BOOT):
+                collapsed = self.collapsed.pop(wc, 0)
+            backlog = self._backlog()
+        finally:
+            self.lock.release()
+
+        if collapsed:
+            logging.info('%s: %d update requests collapsed into this one '
+                         '(%d in total)', wc.path, collapsed,
+                         self.total_collapsed)
+
+        # Warn if the queue is too long.
+        if operation != OP_BOOT and backlog + 1 > BACKLOG_TOO_HIGH:
+            logging.warn('worker backlog is at %d (%s)', backlog + 1,
+                         ', '.join('%s: %d' % item
+                                   for item in self.depths()[:5]))
+        return operation, wc
+
+    def done_work(self, wc):
+        "Release WC, queueing it again if more work arrived meanwhile."
+        self.lock.acquire()
+        try:
+            self.busy.remove(wc)
+            if self.pending[wc]:
+                self.queued.add(wc)
+                self.ready.put(wc)
+            else:
+                del self.pending[wc]
+        finally:
+            self.lock.release()
+
+    def _backlog(self):
+        return sum(len(ops) for ops in self.pending.values())
+
+    def depths(self):
+        "Return (path, pending operations) pairs, deepest first."
+        self.lock.acquire()
+        try:
+            depths = [(wc.path, len(ops)) for wc, ops in self.pending.items()]
+        finally:
+            self.lock.release()
+        depths.sort(key=lambda item: item[1], reverse=True)
+        return depths
+
+
+class BackgroundWorker(threading.Thread):
+    def __init__(self, pool):
+        threading.Thread.__init__(self)
+
+        # The main thread/process should not wait for this thread to exit.
+        ### compat with Python 2.5
+        self.setDaemon(True)
+
+        self.pool = pool
+        self.svnbin = pool.svnbin
+        self.env = pool.env
+        self.hook = pool.hook
+        self.svn = None
+
     def run(self):
+        # Client contexts are not shared between threads.
+        if self.pool.use_bindings:
+            self.svn = InProcessSvn(self.env)
+
         while True:
             # This will block until something arrives
-            operation, wc = self.q.get()
-
-            # Warn if the queue is too long.
-            # (Note: the other thread might have added entries to self.q
-            # after the .get() and before the .qsize().)
-            qsize = self.q.qsize()+1
-            if operation != OP_BOOT and qsize > BACKLOG_TOO_HIGH:
-                logging.warn('worker backlog is at %d', qsize)
+            operation, wc = self.pool.next_work()
 
             try:
                 if operation == OP_UPDATE:
@@ -277,29 +488,17 @@ class BackgroundWorker(threading.Thread):
             except:
                 logging.exception('exception in worker')
 
-            # In case we ever want to .join() against the work queue
-            self.q.task_done()
-
-    def add_work(self, operation, wc):
-        # Start the thread when work first arrives. Thread-start needs to
-        # be delayed in case the process forks itself to become a daemon.
-        if not self.has_started:
-            self.start()
-            self.has_started = True
-
-        self.q.put((operation, wc))
+            self.pool.done_work(wc)
 
     def _update(self, wc, boot=False):
         "Update the specified working copy."
 
-        # For giggles, let's clean up the working copy in case something
-        # happened earlier.
-        self._cleanup(wc)
+        self._cleanup_before_update(wc)
 
         logging.info("updating: %s", wc.path)
 
         ## Run the hook
-        HEAD = svn_info(self.svnbin, self.env, wc.url)['Revision']
+        HEAD = self._head(wc)
         if self.hook:
             hook_mode = ['pre-update', 'pre-boot'][boot]
             logging.info('running hook: %s at %s',
@@ -313,6 +512,57 @@ class BackgroundWorker(threading.Thread):
                 return
             del rc
 
+        revision = self._switch(wc, HEAD)
+        assert revision == HEAD
+        logging.info("updated: %s now at r%s", wc.path, revision)
+
+        ## Run the hook
+        if self.hook:
+            hook_mode = ['post-update', 'boot'][boot]
+            logging.info('running hook: %s at revision %s due to %s',
+                         wc.path, revision, hook_mode)
+            args = [self.hook, hook_mode,
+                    wc.path, revision, wc.url]
+            check_call(args, env=self.env)
+
+    # Each step is done through the bindings if they are in use; if they
+    # fail, it is done again by running svnbin.
+
+    def _cleanup_before_update(self, wc):
+        if self.svn:
+            # Only clean up if something happened earlier; switch() also
+            # cleans up and retries if Subversion says it is necessary.
+            try:
+                if self.svn.cleanup_if_locked(wc.path):
+                    logging.info("cleaned up: %s", wc.path)
+                return
+            except svn.core.SubversionException:
+                logging.exception('bindings failed, running svn cleanup: %s',
+                                  wc.path)
+
+        # For giggles, let's clean up the working copy in case something
+        # happened earlier.
+        self._cleanup(wc)
+
+    def _head(self, wc):
+        "Return the youngest revision at the working copy's URL."
+        if self.svn:
+            try:
+                return str(self.svn.head(wc.url))
+            except svn.core.SubversionException:
+                logging.exception('bindings failed, running svn info: %s',
+                                  wc.url)
+        return svn_info(self.svnbin, self.env, wc.url)['Revision']
+
+    def _switch(self, wc, HEAD):
+        "Switch the working copy to HEAD and return the revision it is at."
+        if self.svn:
+            try:
+                return str(self.svn.switch(wc.path, wc.url, int(HEAD)))
+            except svn.core.SubversionException:
+                logging.exception('bindings failed, running svn switch: %s',
+                                  wc.path)
+
         ### we need to move some of these args into the config. these are
         ### still specific to the ASF setup.
         args = [self.svnbin, 'switch',
@@ -328,18 +578,7 @@ class BackgroundWorker(threading.Thread):
         check_call(args, env=self.env)
 
         ### check the loglevel before running 'svn info'?
-        info = svn_info(self.svnbin, self.env, wc.path)
-        assert info['Revision'] == HEAD
-        logging.info("updated: %s now at r%s", wc.path, info['Revision'])
-
-        ## Run the hook
-        if self.hook:
-            hook_mode = ['post-update', 'boot'][boot]
-            logging.info('running hook: %s at revision %s due to %s',
-                         wc.path, info['Revision'], hook_mode)
-            args = [self.hook, hook_mode,
-                    wc.path, info['Revision'], wc.url]
-            check_call(args, env=self.env)
+        return svn_info(self.svnbin, self.env, wc.path)['Revision']
 
     def _cleanup(self, wc):
         "Run a cleanup on the specified working copy."
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# Tests for the subscriber routing and heartbeat of svnpubsub/server.py.
+#
+# USAGE: python test_server.py    (or: trial test_server)
+#
+
+import sys
+import os
+import unittest
+import collections
+
+from twisted.internet import defer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from svnpubsub import server
+
+
+class Address(object):
+    port = 12345
+
+
+class Request(object):
+    "Just enough of twisted.web.server.Request for SvnPubSub."
+
+    def __init__(self, path, args=None):
+        self.uri = self.path = path
+        self.args = args or {}
+        self.client = Address()
+        self.headers = {}
+        self.code = 200
+        self.written = []
+        self.finished = defer.Deferred()
+
+    def notifyFinish(self):
+        return self.finished
+
+    def getClientIP(self):
+        return '127.0.0.1'
+
+    def getHeader(self, name):
+        return self.headers.get(name.lower())
+
+    def setHeader(self, name, value):
+        pass
+
+    def setResponseCode(self, code):
+        self.code = code
+
+    def registerProducer(self, producer, streaming):
+        pass
+
+    def write(self, data):
+        self.written.append(data)
+
+
+def commit(id, repository='abc', type='svn'):
+    return server.Commit({'repository': repository, 'type': type,
+                          'format': 1, 'id': id, 'changed': {}})
+
+
+class RoutingTests(unittest.TestCase):
+
+    def setUp(self):
+        # The subscriber index and counters live on the class.
+        server.SvnPubSub.clients = []
+        server.SvnPubSub.routes = {}
+        server.SvnPubSub.counters = collections.defaultdict(int)
+        self.pubsub = server.SvnPubSub(server.Commit)
+
+    def subscribe(self, path, since=None):
+        args = {}
+        if since is not None:
+            args['since'] = [str(since)]
+        request = Request(path, args)
+        self.pubsub.render_GET(request)
+        self.assertEqual(request.code, 200)
+        return request
+
+    def received(self, request):
+        return [frame for frame in request.written if '"commit"' in frame]
+
+    def test_filters(self):
+        requests = [ self.subscribe('/commits'),
+                     self.subscribe('/commits/*'),
+                     self.subscribe('/commits/svn/*'),
+                     self.subscribe('/commits/svn/abc'),
+                     self.subscribe('/commits/svn/xyz'),
+                     self.subscribe('/commits/git') ]
+        self.pubsub.notifyAll(commit(1))
+        self.assertEqual([len(self.received(r)) for r in requests],
+                         [1, 1, 1, 1, 0, 0])
+
+    def test_empty_segments(self):
+        # An empty segment is a wildcard, like '*'.
+        requests = [ self.subscribe('/commits/'),
+                     self.subscribe('/commits/svn/'),
+                     self.subscribe('/commits//abc') ]
+        self.pubsub.notifyAll(commit(1))
+        self.assertEqual([len(self.received(r)) for r in requests],
+                         [1, 1, 1])
+
+    def test_empty_segments_resumed(self):
+        self.pubsub.notifyAll(commit(1))
+        request = self.subscribe('/commits/svn/', since=0)
+        self.assertEqual(len(self.received(request)), 1)
+        self.pubsub.notifyAll(commit(2))
+        self.assertEqual(len(self.received(request)), 2)
+
+
+class BrokenRequest(Request):
+    def write(self, data):
+        if 'stillalive' in data:
+            raise IOError('connection gone')
+        Request.write(self, data)
+
+
+class HeartbeatTests(unittest.TestCase):
+
+    def setUp(self):
+        server.SvnPubSub.clients = []
+        server.SvnPubSub.routes = {}
+        server.SvnPubSub.counters = collections.defaultdict(int)
+        self.pubsub = server.SvnPubSub(server.Commit)
+
+    def subscribe(self, request):
+        self.pubsub.render_GET(request)
+        return request
+
+    def test_broken_client(self):
+        good = self.subscribe(Request('/commits'))
+        broken = self.subscribe(BrokenRequest('/commits'))
+        later = self.subscribe(Request('/commits'))
+        self.pubsub.heartbeat()
+        self.pubsub.heartbeat()
+        for request in (good, later):
+            self.assertEqual(len([frame for frame in request.written
+                                  if 'stillalive' in frame]), 2)
+        self.assertEqual(self.pubsub.cc(), 2)
+        self.assertEqual(self.pubsub.stats()['clients_dropped'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()